@@ -0,0 +1,167 @@
+# coding: utf8
+# python 3.8
+# Antoine Laporte
+# Université de Bordeaux - INRAE Bordeaux Aquitaine - DRC
+# PhD : Genome scale metabolic reconstruction of several fruits
+# 11/2021 - 10/2024
+
+"""This file contains the sequence aligners that can be used by the blasting module. Each of them builds the subject's
+database and aligns a batch of the model's sequences on it, giving back the hits in the same format whatever the
+aligner (see HIT_COLUMNS)."""
+
+import abc
+import os
+import shutil
+import subprocess
+
+HIT_COLUMNS = ["qseqid", "qlen", "sseqid", "slen", "length", "nident", "pident", "score", "evalue", "bitscore"]
+
+
+class AlignerError(Exception):
+    """Raised when the process of an aligner fails (crash, killed...), so that its batch isn't taken as a batch without
+    hits."""
+
+
+class Aligner(abc.ABC):
+    """Parent class of the aligners, each child class must define its name, its output format, its binaries and the
+    two abstract methods below with the command lines of the corresponding software."""
+
+    @property
+    @abc.abstractmethod
+    def name(self):
+        """The name of the aligner, used as key in ALIGNERS."""
+
+    @property
+    @abc.abstractmethod
+    def output_format(self):
+        """The output format given to the aligner, one line per hit with the HIT_COLUMNS fields."""
+
+    @property
+    @abc.abstractmethod
+    def binaries(self):
+        """The binaries called by the aligner (database's creation and alignment)."""
+
+    def is_available(self):
+        """Returns True if all the aligner's binaries are found in the PATH."""
+
+        return all(shutil.which(binary) is not None for binary in self.binaries)
+
+    def _run(self, command):
+        """Runs a command line of the aligner.
+
+        PARAMS:
+            command (list) -- the command line.
+        RETURNS:
+            the completed process.
+        RAISES:
+            AlignerError -- if the process doesn't end successfully, with its error output.
+        """
+
+        process = subprocess.run(command, capture_output=True)
+        if process.returncode != 0:
+            raise AlignerError("{} failed (exit code {}) :\n{}".format(" ".join(command[:2]), process.returncode,
+                                                                       process.stderr.decode("ascii", "replace")))
+        return process
+
+    @abc.abstractmethod
+    def make_database(self, fasta_path, database_path):
+        """Builds the database of the subject.
+
+        PARAMS:
+            fasta_path (str) -- the path to the subject's proteomic fasta.
+            database_path (str) -- the path (prefix) of the database to create.
+        RETURNS:
+            the completed process of the database's creation.
+        RAISES:
+            AlignerError -- if the database's creation fails.
+        """
+
+    @abc.abstractmethod
+    def align(self, query_path, database_path):
+        """Aligns the sequences of a fasta file on the subject's database.
+
+        PARAMS:
+            query_path (str) -- the path to the fasta file of the query sequences.
+            database_path (str) -- the path (prefix) of the subject's database.
+        RETURNS:
+            the list of hits, one csv line per hit with the HIT_COLUMNS fields.
+        """
+
+
+class Blastp(Aligner):
+    name = "blastp"
+    output_format = "10 delim=, " + " ".join(HIT_COLUMNS)
+    binaries = ("blastp", "makeblastdb")
+
+    def make_database(self, fasta_path, database_path):
+        return self._run(["makeblastdb", "-in", fasta_path, "-dbtype", "prot", "-parse_seqids", "-out",
+                          database_path])
+
+    def align(self, query_path, database_path):
+        blast_request = [
+            "blastp",
+            "-db",
+            database_path,
+            "-query",
+            query_path,
+            "-outfmt",
+            self.output_format]
+        return self._run(blast_request).stdout.decode('ascii').split("\n")[:-1]
+
+
+class Diamond(Aligner):
+    name = "diamond"
+    output_format = "6 " + " ".join(HIT_COLUMNS)
+    binaries = ("diamond",)
+
+    def make_database(self, fasta_path, database_path):
+        return self._run(["diamond", "makedb", "--in", fasta_path, "--db", database_path, "--threads", "1"])
+
+    def align(self, query_path, database_path):
+        diamond_request = [
+            "diamond",
+            "blastp",
+            "--db",
+            database_path,
+            "--query",
+            query_path,
+            "--threads",
+            "1",
+            "--max-target-seqs",
+            "500",
+            "--outfmt"] + self.output_format.split(" ")
+        output = self._run(diamond_request).stdout.decode('ascii').split("\n")[:-1]
+        return [line.replace("\t", ",") for line in output]
+
+
+class MMseqs2(Aligner):
+    name = "mmseqs"
+    output_format = "query,qlen,target,tlen,alnlen,nident,pident,raw,evalue,bits"
+    binaries = ("mmseqs",)
+
+    def make_database(self, fasta_path, database_path):
+        return self._run(["mmseqs", "createdb", fasta_path, database_path])
+
+    def align(self, query_path, database_path):
+        output_path = query_path + ".m8"
+        mmseqs_request = [
+            "mmseqs",
+            "easy-search",
+            query_path,
+            database_path,
+            output_path,
+            query_path + "_tmp",
+            "--threads",
+            "1",
+            "--max-seqs",
+            "500",
+            "--format-output",
+            self.output_format]
+        self._run(mmseqs_request)
+        if not os.path.isfile(output_path):
+            return []
+        with open(output_path, "r") as output_file:
+            return [line.rstrip("\n").replace("\t", ",") for line in output_file if line.strip()]
+
+
+ALIGNERS = {aligner.name: aligner for aligner in [Blastp(), Diamond(), MMseqs2()]}
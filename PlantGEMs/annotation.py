@@ -0,0 +1,139 @@
+# coding: utf8
+# python 3.8
+# Antoine Laporte
+# Université de Bordeaux - INRAE Bordeaux Aquitaine - DRC
+# PhD : Genome scale metabolic reconstruction of several fruits
+# 11/2021 - 10/2024
+
+"""This file contains the compact storage of a genome's annotation (regions, genes, proteins and CDS found in the
+.gff file), shared by the blasting and mpwting modules."""
+
+import sys
+
+import numpy as np
+
+import utils
+
+
+class GenomeAnnotation:
+    """Compact storage of the information of a .gff file (see utils.get_sequence_region()). Each ID is stored once in
+    the regions, genes and proteins tables, the positions are stored in NumPy arrays and the offsets arrays link each
+    region to its genes, each gene to its proteins and each protein to its CDS :
+        - genes of regions[i] : genes[region_gene_offsets[i]:region_gene_offsets[i + 1]]
+        - proteins of genes[j] : proteins[gene_protein_offsets[j]:gene_protein_offsets[j + 1]]
+        - CDS of proteins[k] : cds[protein_cds_offsets[k]:protein_cds_offsets[k + 1]] (one [start, end] per row)
+    """
+
+    def __init__(self, regions_dict):
+        """
+        ARGS :
+            regions_dict -- the dictionary given by utils.get_sequence_region().
+        """
+
+        self.regions = []
+        self.genes = []
+        self.proteins = []
+        region_gene_offsets, gene_protein_offsets, protein_cds_offsets = [0], [0], [0]
+        gene_start, gene_end, cds = [], [], []
+        for region, genes in regions_dict.items():
+            self.regions.append(sys.intern(region))
+            for gene, gene_info in genes.items():
+                self.genes.append(sys.intern(gene))
+                gene_start.append(int(gene_info["Start"]))
+                gene_end.append(int(gene_info["End"]))
+                for protein, cds_list in gene_info["Proteins"].items():
+                    self.proteins.append(sys.intern(protein))
+                    cds.extend(cds_list)
+                    protein_cds_offsets.append(len(cds))
+                gene_protein_offsets.append(len(self.proteins))
+            region_gene_offsets.append(len(self.genes))
+        self.gene_start = np.array(gene_start, dtype=np.int64)
+        self.gene_end = np.array(gene_end, dtype=np.int64)
+        self.cds = np.array(cds, dtype=np.int64).reshape(-1, 2)
+        self.region_gene_offsets = np.array(region_gene_offsets, dtype=np.int64)
+        self.gene_protein_offsets = np.array(gene_protein_offsets, dtype=np.int64)
+        self.protein_cds_offsets = np.array(protein_cds_offsets, dtype=np.int64)
+
+    def get_region_genes(self, region_index):
+        """Returns the indexes of the genes of a region."""
+
+        return range(self.region_gene_offsets[region_index], self.region_gene_offsets[region_index + 1])
+
+    def get_gene_proteins(self, gene_index):
+        """Returns the indexes of the proteins of a gene."""
+
+        return range(self.gene_protein_offsets[gene_index], self.gene_protein_offsets[gene_index + 1])
+
+    def get_protein_cds(self, protein_index):
+        """Returns the CDS' positions of a protein, one [start, end] row per CDS."""
+
+        return self.cds[self.protein_cds_offsets[protein_index]:self.protein_cds_offsets[protein_index + 1]]
+
+    def get_regions_annotation(self, region_indexes):
+        """Returns a GenomeAnnotation holding only the given regions with their genes, proteins and CDS, numbered again
+        from 0 in the order of region_indexes, so that a worker gets only the part of the annotation it needs."""
+
+        regions_annotation = GenomeAnnotation({})
+        gene_indexes = [gene_index for region_index in region_indexes
+                        for gene_index in self.get_region_genes(region_index)]
+        protein_indexes = [protein_index for gene_index in gene_indexes
+                           for protein_index in self.get_gene_proteins(gene_index)]
+        regions_annotation.regions = [self.regions[region_index] for region_index in region_indexes]
+        regions_annotation.genes = [self.genes[gene_index] for gene_index in gene_indexes]
+        regions_annotation.proteins = [self.proteins[protein_index] for protein_index in protein_indexes]
+        regions_annotation.gene_start = self.gene_start[np.array(gene_indexes, dtype=np.int64)]
+        regions_annotation.gene_end = self.gene_end[np.array(gene_indexes, dtype=np.int64)]
+        regions_annotation.cds = np.concatenate([regions_annotation.cds] + [self.get_protein_cds(protein_index)
+                                                                            for protein_index in protein_indexes])
+        regions_annotation.region_gene_offsets = np.cumsum(
+            [0] + [len(self.get_region_genes(region_index)) for region_index in region_indexes], dtype=np.int64)
+        regions_annotation.gene_protein_offsets = np.cumsum(
+            [0] + [len(self.get_gene_proteins(gene_index)) for gene_index in gene_indexes], dtype=np.int64)
+        regions_annotation.protein_cds_offsets = np.cumsum(
+            [0] + [len(self.get_protein_cds(protein_index)) for protein_index in protein_indexes], dtype=np.int64)
+        return regions_annotation
+
+    def get_protein_gene_index(self):
+        """Function to build the correspondence between the proteins and their gene. Gene IDs are also indexed (on
+        themselves) so that gene reaction rules already written with genes are kept as they are.
+
+        RETURNS:
+            protein_gene_index (dict) -- {protein or gene ID: gene ID}, gene IDs are upper-cased and each protein is
+            found both with its original and its upper-cased ID.
+        """
+
+        protein_gene_index = {}
+        for gene in self.genes:
+            protein_gene_index.setdefault(gene, gene.upper())
+            protein_gene_index.setdefault(gene.upper(), gene.upper())
+        for gene_index in range(len(self.genes)):
+            gene = self.genes[gene_index].upper()
+            for protein_index in self.get_gene_proteins(gene_index):
+                protein_gene_index[self.proteins[protein_index]] = gene
+                protein_gene_index[self.proteins[protein_index].upper()] = gene
+        return protein_gene_index
+
+
+def get_genome_annotation(gff_file_path, use_cache=True):
+    """Function to get the GenomeAnnotation of a .gff file. It is cached next to the gff file (.regions.pkl) with the
+    gff's content hash, so that the file is parsed only once as long as it doesn't change.
+
+    PARAMS:
+        gff_file_path (str) -- the path to the gff file.
+        use_cache (boolean) -- False to parse the gff file again, even if a cache exists.
+    RETURNS:
+        the GenomeAnnotation of the gff file.
+    """
+
+    cache_path = gff_file_path + ".regions.pkl"
+    gff_hash = utils.get_file_hash(gff_file_path)
+    if use_cache:
+        cache = utils.load_obj(cache_path)
+        if cache and cache["hash"] == gff_hash and "annotation" in cache.keys():
+            return cache["annotation"]
+    genome_annotation = GenomeAnnotation(utils.get_sequence_region(gff_file_path))
+    try:
+        utils.save_obj({"hash": gff_hash, "annotation": genome_annotation}, cache_path[:-len(".pkl")])
+    except PermissionError:
+        print("Permission to write the gff cache :\n" + cache_path + "\nnot granted !")
+    return genome_annotation
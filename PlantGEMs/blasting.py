@@ -8,25 +8,33 @@
 
 import argparse
 import cobra
-import copy
+import contextlib
+import hashlib
+import itertools
 import logging
 import multiprocessing
+import multiprocessing.pool
+import numpy as np
 import os
-import re
-import subprocess
+import queue
 import sys
 import time
 
+import aligners
+import annotation
 import graphs
 import module
 import utils
 
+CHECKPOINT_INPUTS = ["model_file_path", "model_proteomic_fasta_path", "subject_proteomic_fasta_path", "gff_file_path"]
+
 
 class Blasting(module.Module):
 
     def __init__(self, _name, _main_directory, _model_file_path=None, _model_proteomic_fasta_path=None,
                  _subject_proteomic_fasta_path=None, _subject_gff_path=None,
-                 identity=50, difference=30, e_val=1e-100, coverage=20, bit_score=300):
+                 identity=50, difference=30, e_val=1e-100, coverage=20, bit_score=300, threads=None, batch_size=500,
+                 aligner="blastp"):
         """
         ARGS :
             _name -- name of the subject, must corresponds to the files' names.
@@ -40,26 +48,26 @@ class Blasting(module.Module):
         super().__init__(_name, _main_directory)
         utils.make_directory(self.main_directory + "blast/")
         if _model_file_path is not None:
-            self.model = cobra.io.read_sbml_model(_model_file_path)
+            self.model_file_path = _model_file_path
         else:
-            self.model = cobra.io.read_sbml_model(self._find_sbml_model(self.main_directory + "/files/"))
+            self.model_file_path = self._find_sbml_model(self.main_directory + "/files/")
+        self.model = cobra.io.read_sbml_model(self.model_file_path)
         if _model_proteomic_fasta_path is not None:
             self.model_proteomic_fasta_path = _model_proteomic_fasta_path
-            self.model_proteomic_fasta = utils.read_file_stringed(self.model_proteomic_fasta_path)
         else:
-            self.model_proteomic_fasta = utils.read_file_stringed(self._find_proteomic_fasta(self.model.id))
+            self.model_proteomic_fasta_path = self._find_proteomic_fasta(self.model.id)
         if _subject_proteomic_fasta_path is not None:
             self.subject_proteomic_fasta_path = _subject_proteomic_fasta_path
-            self.subject_proteomic_fasta = utils.read_file_stringed(self.subject_proteomic_fasta_path)
         else:
             self.subject_proteomic_fasta_path = self._find_proteomic_fasta(self.name)
-            self.subject_proteomic_fasta = utils.read_file_stringed(self.subject_proteomic_fasta_path)
         if _subject_gff_path is not None:
-            self.subject_gff_path = _subject_gff_path
+            self.gff_file_path = _subject_gff_path
         else:
             self.gff_file_path = self._find_gff(self.name)
-        self.regions_dict = utils.get_sequence_region(self.gff_file_path)
+        self.genome_annotation = annotation.get_genome_annotation(self.gff_file_path)
+        self.protein_gene_index = self.genome_annotation.get_protein_gene_index()
         self.blast_result = {}
+        self.blast_hits = None
         self.gene_dictionary = {}
         self.draft = cobra.Model(self.name)
         self._identity = identity
@@ -67,6 +75,9 @@ class Blasting(module.Module):
         self._e_val = e_val
         self._coverage = coverage
         self._bit_score = bit_score
+        self.threads = threads or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.aligner = aligner
         self.version = 1.0
 
         """
@@ -75,6 +86,9 @@ class Blasting(module.Module):
         e_val (int) -- the minimum E-Value of each match.
         coverage (int) -- the minimum sequence coverage of the match (percentage).
         bit_score (int) -- the minimum Bit-Score of each match.
+        threads (int) -- the number of blastp processes launched at the same time (default : number of cores).
+        batch_size (int) -- the number of model's genes sent to each blastp process.
+        aligner (str) -- the aligner used to find the hits (see aligners.ALIGNERS), blastp by default.
         """
 
     @property
@@ -141,100 +155,250 @@ class Blasting(module.Module):
         else:
             print("Bit_score value denied : value must be between 0 and 10000 (both included), value not changed")
 
-    def _blast_run(self):
-        """Runs multiple blasts between the model and the subject."""
+    def _blast_run(self, blast_slots=None):
+        """Runs the blast between the model and the subject, sending the model's proteome by batches of genes
+        (instead of one blastp process per gene) and splitting the output back into the per-gene blast_result.
+        Genes whose sequence and subject haven't changed since the last run are taken from the blast cache. If a batch
+        fails, the error is raised once the other batches are done (see _blast_end()).
+
+        PARAMS:
+            blast_slots (multiprocessing.Semaphore) -- the slots shared with the blasts of the other species running
+            at the same time, one for each aligner process (database's creation or batch), None if the blast runs
+            alone on self.threads processes.
+        """
 
         if not self.gene_dictionary:
-            print(self.name + " : Launching the blast !")
-            i, x = 1, len(self.model.genes)
-            total_time = lap_time = time.time()
-            tmp_dir = self.directory + "tmp_dir/"
-            utils.remove_directory(tmp_dir)
-            utils.make_directory(tmp_dir)
-            for seq in self.model_proteomic_fasta.split(">"):
-                if seq:
-                    try:
-                        gene_name = re.search('\w+(\.\w+)*(-\w+)*', seq).group(0)
-                        utils.write_file(tmp_dir + gene_name + ".fa", [">" + seq])
-                    except AttributeError:
-                        logging.info("Gene name not found in :", seq)
-                        pass
-            for gene in self.model.genes:
-                if i % 10 == 0:
-                    print("\n" + self.name + " : Protein %i out of %i\nTime : %f s\n" % (i, x, time.time() - lap_time))
-                    lap_time = time.time()
-                i += 1
-                blast_request = [
-                    "blastp",
-                    "-subject",
-                    self.subject_proteomic_fasta_path,
-                    "-query",
-                    tmp_dir + gene.id + ".fa",
-                    "-outfmt",
-                    "10 delim=, qseqid qlen sseqid slen length nident pident score evalue bitscore"]
-                self.blast_result[gene.id] = subprocess.run(blast_request,
-                                                            capture_output=True).stdout.decode('ascii').split("\n")[:-1]
-            utils.remove_directory(tmp_dir)
-            log_message = self.name + " : Blast done !\nTotal time : %f s" % (time.time() - total_time)
-            logging.info(log_message)
+            batch_paths = self._blast_prepare(blast_slots)
+            p = multiprocessing.pool.ThreadPool(self.threads)
+            for organism, batch_path, output, error in p.imap_unordered(
+                    run_blast_batch, [(self, path, blast_slots) for path in batch_paths]):
+                self._blast_add_output(batch_path, output, error)
+            p.close()
+            self._blast_end()
+
+    def _blast_prepare(self, blast_slots=None):
+        """First part of the blast : builds the subject's database, takes the genes already blasted from the blast
+        cache and writes the other ones in batch files.
+
+        PARAMS:
+            blast_slots (multiprocessing.Semaphore) -- the slots of the aligner processes (see _blast_run()).
+        RETURNS:
+            batch_paths (list of str) -- the paths to the batch files to blast.
+        """
+
+        print(self.name + " : Launching the blast !")
+        self._start_stage("blast")
+        self._blast_start_time = time.time()
+        tmp_dir = self.directory + "tmp_dir/"
+        utils.remove_directory(tmp_dir)
+        utils.make_directory(tmp_dir)
+        self._make_blast_database(blast_slots)
+        blast_cache = utils.load_obj(self.directory + "blast_cache.pkl") or {}
+        self._new_blast_cache = {}
+        self._genes_keys = {}
+        self._batches_genes = {}
+        self._failed_genes = set()
+        self._blast_errors = []
+        model_index = utils.get_fasta_index(self.model_proteomic_fasta_path)
+        model_proteomic_fasta = open(self.model_proteomic_fasta_path, "rb")
+        batches = []
+        batch = []
+        batches_genes = []
+        batch_genes = []
+        for gene in self.model.genes:
+            self.blast_result[gene.id] = []
+            try:
+                sequence = utils.read_fasta_record(model_proteomic_fasta, model_index, gene.id)[1]
+            except KeyError:
+                logging.info("{} : No sequence found in the model's proteome for {}".format(self.name, gene.id))
+                continue
+            self._genes_keys[gene.id] = self._blast_cache_key(sequence)
+            if self._genes_keys[gene.id] in blast_cache.keys():
+                self.blast_result[gene.id] = [gene.id + line[line.index(","):]
+                                              for line in blast_cache[self._genes_keys[gene.id]]]
+                self._new_blast_cache[self._genes_keys[gene.id]] = blast_cache[self._genes_keys[gene.id]]
+                continue
+            # The genes are named by their position in the batch, the aligners may rewrite some IDs (prefix, spaces...)
+            batch.append(">q" + str(len(batch)) + "\n" + sequence)
+            batch_genes.append(gene.id)
+            if len(batch) == self.batch_size:
+                batches.append(batch)
+                batches_genes.append(batch_genes)
+                batch = []
+                batch_genes = []
+        if batch:
+            batches.append(batch)
+            batches_genes.append(batch_genes)
+        model_proteomic_fasta.close()
+        batch_paths = []
+        for i in range(len(batches)):
+            batch_paths.append(tmp_dir + "batch_" + str(i) + ".fa")
+            utils.write_file(batch_paths[-1], batches[i])
+            self._batches_genes[batch_paths[-1]] = batches_genes[i]
+        print(self.name + " : %i gene(s) found in the blast cache, %i gene(s) to blast in %i batch(es)"
+              % (len(self._new_blast_cache), sum(len(b) for b in batches), len(batches)))
+        return batch_paths
+
+    def _blast_add_output(self, batch_path, output, error=None):
+        """Second part of the blast : splits the output of one batch into the per-gene blast_result, the query ID of
+        each line (q<position of the gene in the batch>) being replaced by the gene's ID, or keeps the error of a failed
+        batch, whose genes won't be put in the blast cache. The genes of a batch with a line matching none of them
+        aren't put in the blast cache either, since some of their hits may be missing.
+
+        PARAMS:
+            batch_path (str) -- the path to the batch file.
+            output (list of str) -- the blast result lines of the batch.
+            error (aligners.AlignerError) -- the error of the aligner, None if the batch succeeded.
+        """
+
+        if error is not None:
+            log_message = "{} : Blast of {} failed, {}".format(self.name, batch_path, error)
+            logging.error(log_message)
             print(log_message)
+            self._failed_genes.update(self._batches_genes[batch_path])
+            self._blast_errors.append(error)
+            return
+        batch_genes = self._batches_genes[batch_path]
+        for line in output:
+            query_id, _, hit = line.partition(",")
+            try:
+                gene_id = batch_genes[int(query_id[1:])] if query_id.startswith("q") else None
+            except (ValueError, IndexError):
+                gene_id = None
+            if gene_id is None:
+                logging.warning("{} : Blast result line not matching any gene of the batch, ignored and the genes of "
+                                "the batch not cached : {}".format(self.name, line))
+                self._failed_genes.update(batch_genes)
+                continue
+            self.blast_result[gene_id].append(gene_id + "," + hit)
+
+    def _blast_end(self):
+        """Last part of the blast, once every batch has been added : updates the blast cache with the genes of the
+        batches that succeeded, makes the hit table and saves it in the 'blasted' checkpoint, recorded as the output of
+        the blast stage. If a batch failed, its error is raised instead, once the blast cache is saved."""
+
+        for gene_id, key in self._genes_keys.items():
+            if key not in self._new_blast_cache.keys() and gene_id not in self._failed_genes:
+                self._new_blast_cache[key] = self.blast_result[gene_id]
+        utils.save_obj(self._new_blast_cache, self.directory + "blast_cache")
+        blast_errors = self._blast_errors
+        self._new_blast_cache, self._genes_keys, self._batches_genes = {}, {}, {}
+        self._failed_genes, self._blast_errors = set(), []
+        utils.remove_directory(self.directory + "tmp_dir/")
+        if blast_errors:
+            self.blast_result = {}
+            logging.error("{} : {} blast batch(es) failed, the blast isn't done".format(self.name, len(blast_errors)))
+            raise blast_errors[0]
+        self.blast_hits = make_hit_table([line for lines in self.blast_result.values() for line in lines])
+        self.blast_result = {}
+        self._object_history_save("blasted", blast_hits=self.blast_hits)
+        self._save_stage_record("blast", self._get_stage_fingerprint("blast"),
+                                [self.directory + "objects_history/blasted.pkl"])
+        log_message = self.name + " : Blast done !\nTotal time : %f s" % (time.time() - self._blast_start_time)
+        logging.info(log_message)
+        print(log_message)
+
+    def _blast_cache_key(self, sequence):
+        """Function to get the key of a query's blast results in the blast cache, built from the query's sequence, the
+        subject's proteomic fasta, the aligner and its output format so that any change in one of them invalidates the
+        entry.
+
+        PARAMS:
+            sequence (str) -- the query's protein sequence.
+        RETURNS:
+            the hexadecimal md5 hash used as key.
+        """
+
+        return hashlib.md5("\t".join(("".join(sequence.split()).upper(), self.subject_proteomic_fasta_hash,
+                                       self.aligner, aligners.ALIGNERS[self.aligner].output_format))
+                           .encode()).hexdigest()
+
+    def _make_blast_database(self, blast_slots=None):
+        """Builds the subject's database with the chosen aligner, or reuses the one stored in the 'db/' directory if
+        the subject's proteomic fasta hasn't changed since it was built (checked with the file's content hash).
+
+        PARAMS:
+            blast_slots (multiprocessing.Semaphore) -- the slots of the aligner processes (see _blast_run()).
+        RAISES:
+            aligners.AlignerError -- if the aligner isn't installed or the database's creation fails.
+        """
+
+        aligner = aligners.ALIGNERS[self.aligner]
+        if not aligner.is_available():
+            log_message = "{} : {} not found, please install it or choose another aligner".format(
+                self.name, " and ".join(aligner.binaries))
+            logging.error(log_message)
+            raise aligners.AlignerError(log_message)
+        db_directory = self.directory + "db/" + aligner.name + "/"
+        hash_file_path = db_directory + "subject.hash"
+        self.subject_proteomic_fasta_hash = utils.get_file_hash(self.subject_proteomic_fasta_path)
+        self.subject_database_path = db_directory + self.name
+        if os.path.isfile(hash_file_path) and \
+                utils.read_file_stringed(hash_file_path).strip() == self.subject_proteomic_fasta_hash:
+            logging.info("{} : Reusing the {} database found in {}".format(self.name, aligner.name, db_directory))
+            return
+        print(self.name + " : Building the subject's " + aligner.name + " database...")
+        utils.remove_directory(db_directory)
+        utils.make_directory(self.directory + "db/")
+        utils.make_directory(db_directory)
+        try:
+            with blast_slots or contextlib.nullcontext():
+                aligner.make_database(self.subject_proteomic_fasta_path, self.subject_database_path)
+        except aligners.AlignerError as error:
+            logging.error("{} : {} database creation failed, {}".format(self.name, aligner.name, error))
+            raise
+        utils.write_file(hash_file_path, [self.subject_proteomic_fasta_hash])
+        logging.info("{} : {} database built in {}".format(self.name, aligner.name, db_directory))
+
+    def _blast_batch(self, query_path):
+        """Aligns a fasta file holding a batch of the model's genes on the subject's database with the chosen aligner.
+
+        PARAMS:
+            query_path (str) -- the path to the batch's fasta file.
+        RETURNS:
+            the list of hits (csv format, see aligners.HIT_COLUMNS) for all the genes of the batch.
+        """
+
+        return aligners.ALIGNERS[self.aligner].align(query_path, self.subject_database_path)
 
     def _select_genes(self):
         """Select the subject organism's genes regarding the different threshold parameters of the Blasting instance."""
 
-        if not self.blast_result:
+        if getattr(self, "blast_hits", None) is None and self.blast_result:
+            self.blast_hits = make_hit_table([line for lines in self.blast_result.values() for line in lines])
+            self.blast_result = {}
+        if getattr(self, "blast_hits", None) is None:
             logging.info(self.name + " : No blast results found... Please run a blast with blast_run() before launching"
                                      " select_genes()")
             print("No blast results found... Please run a blast with blast_run() before launching select_genes()")
         else:
-            wrong_identity, wrong_difference, wrong_coverage, wrong_bit_score, wrong_e_val = [], [], [], [], []
+            hits = self.blast_hits
+            wrong_identity, wrong_difference, wrong_coverage, wrong_bit_score, wrong_e_val = \
+                get_hits_masks(hits, self.identity, self.difference, self.e_val, self.coverage, self.bit_score)
+            selected = ~(wrong_identity | wrong_difference | wrong_coverage | wrong_bit_score | wrong_e_val)
             selected_proteins = [["Protein Model\tSize P. Model\tProtein Subject\tSize P. Subject\tAlignment length\t"
                                   "Number of identity\tPercentage of identity\tScore\tEValue\tBitScore"]]
-            for key in self.blast_result.keys():  # key = region name
-                for res in self.blast_result[key]:
-                    spl = res.split(",")
-                    for i in range(len(spl)):
-                        try:
-                            spl[i] = float(spl[i])
-                        except ValueError:
-                            pass
-                    len_subject = spl[3]
-                    len_query = [spl[1] * (100 - self.difference) / 100, spl[1] * (100 + self.difference) / 100]
-                    min_align = self.coverage / 100 * spl[1]
-                    selected = True
-                    if spl[6] < self.identity:
-                        wrong_identity.append(res)
-                        selected = False
-                    if not len_query[0] <= len_subject <= len_query[1]:
-                        wrong_difference.append(res)
-                        selected = False
-                    if spl[4] < min_align:
-                        wrong_coverage.append(res)
-                        selected = False
-                    if spl[9] < self.bit_score:
-                        wrong_bit_score.append(res)
-                        selected = False
-                    if spl[8] > self.e_val:
-                        wrong_e_val.append(res)
-                        selected = False
-                    if selected:
-                        selected_proteins.append([str.replace(res, ",", "\t")])
-                        try:
-                            self.gene_dictionary[key].append(spl[2])
-                        except KeyError:
-                            self.gene_dictionary[key] = [spl[2]]
-            removed_proteins_upsetplot_dict = {"Identity": wrong_identity,
-                                               "Difference": wrong_difference,
-                                               "Coverage": wrong_coverage,
-                                               "Bit_Score": wrong_bit_score,
-                                               "E_Value": wrong_e_val}
+            for hit in hits[selected].tolist():
+                selected_proteins.append(["\t".join(str(field) for field in hit)])
+                try:
+                    self.gene_dictionary[hit[0]].append(hit[2])
+                except KeyError:
+                    self.gene_dictionary[hit[0]] = [hit[2]]
+            hits_labels = np.char.add(np.char.add(hits["qseqid"], ","), hits["sseqid"])
+            removed_proteins_upsetplot_dict = {"Identity": hits_labels[wrong_identity].tolist(),
+                                               "Difference": hits_labels[wrong_difference].tolist(),
+                                               "Coverage": hits_labels[wrong_coverage].tolist(),
+                                               "Bit_Score": hits_labels[wrong_bit_score].tolist(),
+                                               "E_Value": hits_labels[wrong_e_val].tolist()}
             graphs.make_upsetplot(self.directory, "removed_proteins_plot", removed_proteins_upsetplot_dict,
                                   "Thresholds responsible for unselected proteins")
             utils.write_csv(self.directory, "selected_proteins", selected_proteins)
 
     def _drafting(self):
-        """Creates the new COBRA model for the subject organism."""
+        """Creates the new COBRA model for the subject organism. The selected reactions are gathered first with their
+        new gene reaction rule, then copied without the template model and added to the draft in a single call."""
 
+        selected_reactions = []
         for reaction in self.model.reactions:
             to_add = []
             for gene in reaction.gene_reaction_rule.split(" or "):
@@ -246,77 +410,189 @@ class Blasting(module.Module):
                     pass
             string_reaction_rule = " or ".join(to_add)
             if string_reaction_rule:
-                x = copy.deepcopy(reaction)
-                x.gene_reaction_rule = string_reaction_rule
-                self.draft.add_reactions([x])
+                selected_reactions.append((reaction, string_reaction_rule))
+        metabolites = {}
+        self.draft.add_reactions([utils.copy_reaction(reaction, metabolites, string_reaction_rule)
+                                  for reaction, string_reaction_rule in selected_reactions])
+
+    def _object_history_save(self, step, **step_data):
+        """Saves a checkpoint of a building step. It only holds what the step produced (step_data), the thresholds and
+        references to the input files (path and content hash) instead of the whole object.
+
+        PARAMS:
+            step (str) -- the name of the step, used as file name.
+            step_data -- the data produced by the step (hit table, selected genes, draft's reactions...).
+        """
 
-    def _object_history_save(self, step):
         objects_directory = self.directory + "objects_history/"
         utils.make_directory(objects_directory)
-        utils.save_obj(self, objects_directory + step)
+        checkpoint = {"version": self.version,
+                      "name": self.name,
+                      "aligner": self.aligner,
+                      "inputs": {},
+                      "thresholds": {"identity": self.identity, "difference": self.difference, "e_val": self.e_val,
+                                     "coverage": self.coverage, "bit_score": self.bit_score}}
+        for path_attribute in CHECKPOINT_INPUTS:
+            path = getattr(self, path_attribute)
+            checkpoint["inputs"][path_attribute] = (path, utils.get_file_hash(path))
+        checkpoint.update(step_data)
+        utils.save_obj(checkpoint, objects_directory + step)
+
+    def _get_stage_fingerprint(self, stage):
+        """Returns the fingerprint of the inputs and parameters of a building stage : blast, select or draft (see
+        module.Module._is_stage_done()). Each stage takes the checkpoint made by the previous one as input."""
+
+        objects_directory = self.directory + "objects_history/"
+        if stage == "blast":
+            return self._get_fingerprint({"model": self.model_file_path,
+                                          "model_proteome": self.model_proteomic_fasta_path,
+                                          "subject_proteome": self.subject_proteomic_fasta_path},
+                                         {"aligner": self.aligner})
+        if stage == "select":
+            return self._get_fingerprint({"blasted": objects_directory + "blasted.pkl"},
+                                         {"identity": self.identity, "difference": self.difference,
+                                          "e_val": self.e_val, "coverage": self.coverage,
+                                          "bit_score": self.bit_score})
+        return self._get_fingerprint({"genes_selected": objects_directory + "genes_selected.pkl",
+                                      "model": self.model_file_path, "gff": self.gff_file_path})
+
+    def _get_draft_reactions(self):
+        """Returns the draft's reactions' IDs with their gene reaction rule, in a dictionary."""
+
+        return {reaction.id: reaction.gene_reaction_rule for reaction in self.draft.reactions}
 
     def _make_protein_correspondence_file(self):
-        """Function to create a csv file with the correspondence between a protein and the associated gene."""
+        """Function to create a csv file with the correspondence between a protein and the associated gene. This file
+        is only an output for the user, the correspondence used by the process is protein_gene_index."""
 
         correspondence = []
-        for region in self.regions_dict.keys():
-            for gene in self.regions_dict[region].keys():
-                for protein in self.regions_dict[region][gene]["Proteins"].keys():
-                    correspondence.append([gene.upper(), protein.upper()])
+        genome_annotation = self.genome_annotation
+        for gene_index in range(len(genome_annotation.genes)):
+            for protein_index in genome_annotation.get_gene_proteins(gene_index):
+                correspondence.append([genome_annotation.genes[gene_index].upper(),
+                                       genome_annotation.proteins[protein_index].upper()])
         utils.write_csv(self.directory, "protein_gene_correspondence", correspondence, "\t")
 
     def _protein_to_gene(self):
         """Function to transform the proteins in gene_reaction_rule into their corresponding genes.
         It creates a new model that will have all the genes' names instead of the proteins' ones."""
 
-        correspondence_file_path = self.directory + "protein_gene_correspondence.tsv"
-        if os.path.isfile(correspondence_file_path):
-            gene_protein_dict, gene_protein_dict_reversed = utils.build_correspondence_dict(correspondence_file_path)
-            for reaction in self.draft.reactions:
-                genes = []
-                list_proteins = reaction.gene_reaction_rule.split(" or ")
-                for protein in list(filter(None, [trans.upper() for trans in list_proteins])):
+        for reaction in self.draft.reactions:
+            genes = []
+            for protein in filter(None, reaction.gene_reaction_rule.split(" or ")):
+                try:
+                    genes.append(self.protein_gene_index[protein])
+                except KeyError:
                     try:
-                        genes.append(gene_protein_dict_reversed[protein])
+                        genes.append(self.protein_gene_index[protein.upper()])
                     except KeyError:
-                        try:
-                            if protein in gene_protein_dict.keys():
-                                genes.append(protein)
-                        except KeyError:
-                            log_message = self.name + " : No match for : ", protein
-                            logging.error(log_message)
-                            print(log_message)
-                reaction.gene_reaction_rule = " or ".join(set(genes))
-        else:
-            log_message = self.name + " : No correspondence file found here : " + correspondence_file_path + \
-                          "\nAborting..."
-            logging.info(log_message)
-            print(log_message)
-            sys.exit()
+                        log_message = self.name + " : No match for : " + protein
+                        logging.error(log_message)
+                        print(log_message)
+            reaction.gene_reaction_rule = " or ".join(set(genes))
+
+    def build(self, blast_slots=None):
+        """Function to make the blast draft, in three stages (blast, genes' selection and drafting). A stage whose
+        completion record is up to date is skipped, the next one starting from its checkpoint (see
+        module.Module._is_stage_done()).
+
+        PARAMS:
+            blast_slots (multiprocessing.Semaphore) -- the slots of the aligner processes (see _blast_run()).
+        """
 
-    def build(self):
         utils.make_directory(self.directory)
+        if self._is_stage_done("blast", self._get_stage_fingerprint("blast")):
+            logging.info("{} : Blast stage up to date, the blast results are kept".format(self.name))
+            print(self.name + " : Blast stage up to date, the blast results are kept")
+        else:
+            self._blast_run(blast_slots)
+        self.build_draft()
+
+    def build_draft(self):
+        """Second part of build(), once the blast is done : genes' selection and drafting."""
+
+        objects_directory = self.directory + "objects_history/"
+        select_fingerprint = self._get_stage_fingerprint("select")
+        if self._is_stage_done("select", select_fingerprint):
+            logging.info("{} : Select stage up to date, the selected genes are kept".format(self.name))
+            self.gene_dictionary = utils.load_obj(objects_directory + "genes_selected.pkl")["gene_dictionary"]
+        else:
+            self._start_stage("select")
+            if self.blast_hits is None:
+                self.blast_hits = utils.load_obj(objects_directory + "blasted.pkl")["blast_hits"]
+            self._select_genes()
+            self._object_history_save("genes_selected", gene_dictionary=self.gene_dictionary)
+            self._save_stage_record("select", select_fingerprint, [objects_directory + "genes_selected.pkl",
+                                                                   self.directory + "selected_proteins.csv"])
+        draft_fingerprint = self._get_stage_fingerprint("draft")
+        if self._is_stage_done("draft", draft_fingerprint):
+            logging.info("{} : Draft stage up to date, the blast draft is kept".format(self.name))
+            print(self.name + " : Draft stage up to date, the blast draft is kept")
+            return
+        self._start_stage("draft")
         self._make_protein_correspondence_file()
-        self._blast_run()
-        self._object_history_save("blasted")
-        self._select_genes()
-        self._object_history_save("genes_selected")
         self._drafting()
-        self._object_history_save("drafted")
+        self._object_history_save("drafted", draft_reactions=self._get_draft_reactions())
         self._protein_to_gene()
         cobra.io.save_json_model(self.draft, self.directory + self.name + "_blast_draft" + ".json")
+        self._save_stage_record("draft", draft_fingerprint, [objects_directory + "drafted.pkl",
+                                                             self.directory + self.name + "_blast_draft.json",
+                                                             self.directory + "protein_gene_correspondence.tsv"])
 
     def rebuild(self):
         surname = "_".join((str(self.identity), str(self.difference), str(self.e_val), str(self.coverage),
                             str(self._bit_score)))
         self._select_genes()
-        self._object_history_save("genes_selected_" + surname)
+        self._object_history_save("genes_selected_" + surname, gene_dictionary=self.gene_dictionary)
         self._drafting()
-        self._object_history_save("drafted_" + surname)
+        self._object_history_save("drafted_" + surname, draft_reactions=self._get_draft_reactions())
         self._protein_to_gene()
         cobra.io.save_json_model(self.draft, self.directory + self.name + "_blast_draft_rebuild_" + surname + ".json")
 
 
+def make_hit_table(blast_lines):
+    """Function to convert blast result lines (see aligners.HIT_COLUMNS) into a columnar NumPy structured array, so that
+    the thresholds can be applied on whole columns at once.
+
+    PARAMS:
+        blast_lines (list of str) -- the blast result lines, in csv format.
+    RETURNS:
+        hits -- a structured array with one row per hit and one field per column of aligners.HIT_COLUMNS.
+    """
+
+    rows = []
+    for line in blast_lines:
+        spl = line.split(",")
+        rows.append((spl[0], int(spl[1]), spl[2], int(spl[3]), int(spl[4]), int(spl[5]), float(spl[6]),
+                     float(spl[7]), float(spl[8]), float(spl[9])))
+    qseqid_size = max([len(row[0]) for row in rows], default=1)
+    sseqid_size = max([len(row[2]) for row in rows], default=1)
+    dtype = [("qseqid", "U%i" % qseqid_size), ("qlen", "i4"), ("sseqid", "U%i" % sseqid_size), ("slen", "i4"),
+             ("length", "i4"), ("nident", "i4"), ("pident", "f8"), ("score", "f8"), ("evalue", "f8"),
+             ("bitscore", "f8")]
+    return np.array(rows, dtype=dtype)
+
+
+def get_hits_masks(hits, identity, difference, e_val, coverage, bit_score):
+    """Function to apply each threshold on a hit table (see make_hit_table()) as a vectorized test.
+
+    PARAMS:
+        hits -- the structured array of blast hits.
+        identity, difference, e_val, coverage, bit_score -- the threshold values (see Blasting).
+    RETURNS:
+        the five boolean masks of the hits rejected by the identity, difference, coverage, bit_score and e_val
+        thresholds (in this order).
+    """
+
+    wrong_identity = hits["pident"] < identity
+    wrong_difference = (hits["slen"] < hits["qlen"] * (100 - difference) / 100) | \
+                       (hits["slen"] > hits["qlen"] * (100 + difference) / 100)
+    wrong_coverage = hits["length"] < coverage / 100 * hits["qlen"]
+    wrong_bit_score = hits["bitscore"] < bit_score
+    wrong_e_val = hits["evalue"] > e_val
+    return wrong_identity, wrong_difference, wrong_coverage, wrong_bit_score, wrong_e_val
+
+
 def blast_multirun_first(args):
     """
     Split of major function 'run', first part = gathering the files and candidates' names and creating one
@@ -334,10 +610,14 @@ def blast_multirun_first(args):
                              "\n - Difference : " + str(args.difference) +
                              "\n - E_Value : " + str(args.e_val) +
                              "\n - Coverage : " + str(args.coverage) +
-                             "\n - Bit_Score : " + str(args.bit_score))
+                             "\n - Bit_Score : " + str(args.bit_score) +
+                             "\n - Threads : " + str(args.threads) +
+                             "\n - Batch size : " + str(args.batch_size) +
+                             "\n - Aligner : " + args.aligner)
                 list_objects.append(Blasting(parameters[i]["ORGANISM_NAME"], args.main_directory,
                                              identity=args.identity, difference=args.difference, e_val=args.e_val,
-                                             coverage=args.coverage, bit_score=args.bit_score))
+                                             coverage=args.coverage, bit_score=args.bit_score, threads=args.threads,
+                                             batch_size=args.batch_size, aligner=args.aligner))
     else:
         log_message = "Main directory given does not exist : " + args.main_directory
         logging.error(log_message)
@@ -345,21 +625,129 @@ def blast_multirun_first(args):
     return list_objects
 
 
-def blast_multirun_last(list_objects):
+def blast_multirun_last(list_objects, cpu=None):
     """
     Split of major function 'run', second part = launching the process on each given object with multiprocessing.
+    The objects are blasted together (see blast_objects()), then each object's genes' selection and drafting is made.
+    The objects with a failed blast aren't drafted and the run ends with an error once the others are drafted.
     """
 
-    cpu = len(list_objects)
-    logging.info("Launching %i processes with multiprocess" % cpu)
-    p = multiprocessing.Pool(cpu)
-    p.map(build_blast_objects, list_objects)
+    if cpu is None:
+        cpu = multiprocessing.cpu_count()
+    failed_objects = blast_objects(list_objects, cpu)
+    list_objects = [organism for organism in list_objects if organism not in failed_objects]
+    if list_objects:
+        p = multiprocessing.Pool(min(cpu, len(list_objects)))
+        p.map(build_draft_blast_objects, list_objects)
+    if failed_objects:
+        log_message = "Blast failed for : " + ", ".join(organism.name for organism in failed_objects)
+        logging.error(log_message)
+        sys.exit(log_message)
 
 
-def build_blast_objects(organism_object):
+def blast_objects(list_objects, cpu=None):
+    """Function to blast the given objects together : the databases' creations and the blast batches of all the objects
+    are put in a single queue shared by 'cpu' workers (default : number of cores), so that every core stays busy until
+    the last batch. The batches of an object are queued as soon as its database is ready. The objects whose blast
+    stage is up to date are not blasted again (see Blasting.build()).
+
+    PARAMS:
+        list_objects (list of Blasting) -- the objects to blast.
+        cpu (int) -- the number of aligner processes running at the same time.
+    RETURNS:
+        failed_objects (list of Blasting) -- the objects whose blast failed.
+    """
+
+    if cpu is None:
+        cpu = multiprocessing.cpu_count()
+    p = multiprocessing.pool.ThreadPool(cpu)
+    results = queue.Queue()
+    pending = 0
+    remaining_batches = {}
+    failed_objects = []
+    for organism in list_objects:
+        utils.make_directory(organism.directory)
+        if organism._is_stage_done("blast", organism._get_stage_fingerprint("blast")):
+            logging.info("{} : Blast stage up to date, the blast results are kept".format(organism.name))
+            print(organism.name + " : Blast stage up to date, the blast results are kept")
+            continue
+        p.apply_async(prepare_blast_objects, (organism,), callback=lambda result: results.put(("database", result)),
+                      error_callback=results.put)
+        pending += 1
+    count = 0
+    while pending:
+        result = results.get()
+        pending -= 1
+        if isinstance(result, BaseException):
+            p.terminate()
+            raise result
+        step, result = result
+        if step == "database":
+            organism, batch_paths, error = result
+            if error is not None:
+                log_message = "{} : The blast database couldn't be made, {}".format(organism.name, error)
+                logging.error(log_message)
+                print(log_message)
+                failed_objects.append(organism)
+                continue
+            remaining_batches[organism.name] = len(batch_paths)
+            logging.info("{} : Launching {} blast batch(es)".format(organism.name, len(batch_paths)))
+            for batch_path in batch_paths:
+                p.apply_async(run_blast_batch, ((organism, batch_path, None),),
+                              callback=lambda result: results.put(("batch", result)), error_callback=results.put)
+            pending += len(batch_paths)
+        else:
+            organism, batch_path, output, error = result
+            count += 1
+            if count % 10 == 0:
+                print("%i blast batches done" % count)
+            organism._blast_add_output(batch_path, output, error)
+            remaining_batches[organism.name] -= 1
+        if remaining_batches[organism.name] == 0:
+            try:
+                organism._blast_end()
+            except aligners.AlignerError:
+                failed_objects.append(organism)
+    p.close()
+    p.join()
+    return failed_objects
+
+
+def prepare_blast_objects(organism_object):
+    """Small function required for the multiprocessing blast, building the database and the batch files of
+    organism_object (see Blasting._blast_prepare()). The error of the database's creation is given back instead of
+    being raised, so that the other objects go on."""
+
+    try:
+        return organism_object, organism_object._blast_prepare(), None
+    except aligners.AlignerError as error:
+        return organism_object, None, error
+
+
+def run_blast_batch(task):
+    """Small function required for the multiprocessing blast, task is an (organism, batch path, blast slots) tuple (see
+    Blasting._blast_run() for the slots). The error of a failed batch is given back with it instead of being raised, so
+    that the other batches go on."""
+
+    organism, batch_path, blast_slots = task
+    try:
+        with blast_slots or contextlib.nullcontext():
+            return organism, batch_path, organism._blast_batch(batch_path), None
+    except aligners.AlignerError as error:
+        return organism, batch_path, None, error
+
+
+def build_blast_objects(organism_object, blast_slots=None):
+    """Small function required for the multiprocessing reconstruction, the aligner processes of organism_object taking
+    the blast slots shared with the other species (see Blasting._blast_run())."""
+
+    organism_object.build(blast_slots)
+
+
+def build_draft_blast_objects(organism_object):
     """Small function required for the multiprocessing reconstruction."""
 
-    organism_object.build()
+    organism_object.build_draft()
 
 
 def run(args):
@@ -369,7 +757,7 @@ def run(args):
     logging.info("Reading parameters...")
     list_objects = blast_multirun_first(args)
     logging.info("Launching the blast(s) with given parameters...")
-    blast_multirun_last(list_objects)
+    blast_multirun_last(list_objects, args.threads)
 
 
 def run_unique(args):
@@ -381,24 +769,76 @@ def run_unique(args):
     logging.info("\n------ Running a unique species ------")
     logging.info("\nParameters for : {}\n - Main directory : {}\n - Model's file's path : {}\n - Model's proteomic "
                  "fasta's path : {}\n - Subject's proteomic fasta's path : {}\n - Subject's gff file's path : {}\n"
-                 " - Identity : {}\n - Difference : {}\n - E_Value : {}\n - Coverage : {}\n - Bit_Score : {}"
+                 " - Identity : {}\n - Difference : {}\n - E_Value : {}\n - Coverage : {}\n - Bit_Score : {}\n"
+                 " - Threads : {}\n - Batch size : {}\n - Aligner : {}"
                  .format(args.name, args.main_directory, args.model_file_path, args.model_proteomic_fasta_path,
                          args.subject_proteomic_fasta_path, args.subject_gff_path,
-                         args.identity, args.difference, args.e_val, args.coverage, args.bit_score))
+                         args.identity, args.difference, args.e_val, args.coverage, args.bit_score,
+                         args.threads, args.batch_size, args.aligner))
     unique_blast = Blasting(args.name, args.main_directory, args.model_file_path, args.model_proteomic_fasta_path,
                             args.subject_proteomic_fasta_path, args.subject_gff_path,
-                            args.identity, args.difference, args.e_val, args.coverage, args.bit_score)
+                            args.identity, args.difference, args.e_val, args.coverage, args.bit_score,
+                            args.threads, args.batch_size, args.aligner)
     unique_blast.build()
 
 
+def load_blasted_checkpoint(main_directory, name):
+    """Function to get back a Blasting object from the 'blasted' checkpoint of a species, rebuilt from the input files
+    referenced in the checkpoint and holding its blast hit table.
+
+    PARAMS:
+        main_directory (str) -- the main directory.
+        name (str) -- the species' name.
+    RETURNS:
+        species -- the Blasting object, ready for a new genes' selection.
+    """
+
+    checkpoint_path = utils.slash(main_directory) + "blast/" + name + "/objects_history/blasted.pkl"
+    checkpoint = utils.load_obj(checkpoint_path)
+    if checkpoint is None:
+        log_message = "No blasted checkpoint found here : " + checkpoint_path
+        logging.error(log_message)
+        sys.exit(log_message)
+    if isinstance(checkpoint, Blasting):  # Whole object saved by a previous version
+        species = checkpoint
+        species.main_directory = utils.slash(main_directory)
+        species.aligner = getattr(species, "aligner", "blastp")
+        # The paths to the input files weren't all kept by the previous versions, they are found as in __init__()
+        if getattr(species, "model_file_path", None) is None:
+            species.model_file_path = species._find_sbml_model(species.main_directory + "/files/")
+        if getattr(species, "model_proteomic_fasta_path", None) is None:
+            species.model_proteomic_fasta_path = species._find_proteomic_fasta(species.model.id)
+        if getattr(species, "subject_proteomic_fasta_path", None) is None:
+            species.subject_proteomic_fasta_path = species._find_proteomic_fasta(species.name)
+        if getattr(species, "gff_file_path", None) is None:
+            species.gff_file_path = getattr(species, "subject_gff_path", None) or species._find_gff(species.name)
+        if getattr(species, "protein_gene_index", None) is None:
+            species.genome_annotation = annotation.get_genome_annotation(species.gff_file_path)
+            species.protein_gene_index = species.genome_annotation.get_protein_gene_index()
+        if getattr(species, "blast_hits", None) is None:
+            species.blast_hits = make_hit_table([line for lines in species.blast_result.values() for line in lines])
+            species.blast_result = {}
+        return species
+    for path_attribute, (path, file_hash) in checkpoint["inputs"].items():
+        if not os.path.isfile(path) or utils.get_file_hash(path) != file_hash:
+            log_message = "{} : {} has changed since the blast, the selection will be made on outdated blast " \
+                          "results, consider running the blast again.".format(name, path)
+            logging.warning(log_message)
+            print(log_message)
+    species = Blasting(name, main_directory, *[checkpoint["inputs"][i][0] for i in CHECKPOINT_INPUTS],
+                       aligner=checkpoint.get("aligner", "blastp"), **checkpoint["thresholds"])
+    species.subject_proteomic_fasta_hash = checkpoint["inputs"]["subject_proteomic_fasta_path"][1]
+    species.blast_hits = checkpoint["blast_hits"]
+    return species
+
+
 def rerun_blast_selection(main_directory, name, identity=50, difference=30, e_val=1e-100, coverage=20, bit_score=300):
     logging.info("\n------ Rerunning a species' genes selection ------")
-    species = utils.load_obj(utils.slash(main_directory) + "blast/" + name + "/objects_history/blasted.pkl")
+    species = load_blasted_checkpoint(main_directory, name)
     logging.info("Parameters for : {}\n - Main directory : {}\n - Identity : {} -> {}\n - Difference : {} -> {}\n"
                  " - E_Value : {} -> {}\n - Coverage : {} -> {}\n - Bit_Score : {} -> {}"
                  .format(species.name, species.main_directory, species.identity, identity, species.difference,
                          difference, species.e_val, e_val, species.coverage, coverage, species.bit_score, bit_score))
-    species.main_directory = main_directory
     species.identity = identity
     species.difference = difference
     species.e_val = e_val
@@ -409,6 +849,63 @@ def rerun_blast_selection(main_directory, name, identity=50, difference=30, e_va
     species.rebuild()
 
 
+def sweep_blast_selection(main_directory, name, identity_values, difference_values, e_val_values, coverage_values,
+                          bit_score_values, drafts=None):
+    """Function to evaluate every combination of threshold values on an existing blasted.pkl object in one pass over
+    its hit table. The number of selected proteins and of draft reactions of each combination is written in
+    threshold_sweep.tsv and only the combinations chosen are turned into drafts.
+
+    PARAMS:
+        main_directory (str) -- the main directory.
+        name (str) -- the species' name.
+        identity_values, difference_values, e_val_values, coverage_values, bit_score_values (lists) -- the values to
+            test for each threshold.
+        drafts (list of int) -- the numbers of the combinations (see threshold_sweep.tsv) to make drafts of.
+    """
+
+    logging.info("\n------ Sweeping a species' genes selection thresholds ------")
+    species = load_blasted_checkpoint(main_directory, name)
+    hits = species.blast_hits
+    query_genes, hits_query_index = np.unique(hits["qseqid"], return_inverse=True)
+    query_genes_index = {gene: i for i, gene in enumerate(query_genes.tolist())}
+    reactions_genes_index = []
+    reactions_starts = []
+    for reaction in species.model.reactions:
+        genes_index = [query_genes_index[gene] for gene in reaction.gene_reaction_rule.split(" or ")
+                       if gene in query_genes_index.keys()]
+        if genes_index:
+            reactions_starts.append(len(reactions_genes_index))
+            reactions_genes_index.extend(genes_index)
+    reactions_genes_index = np.array(reactions_genes_index, dtype=int)
+    reactions_starts = np.array(reactions_starts, dtype=int)
+    grid = list(itertools.product(identity_values, difference_values, e_val_values, coverage_values,
+                                  bit_score_values))
+    sweep = [["Point", "Identity", "Difference", "E_Value", "Coverage", "Bit_Score", "Selected hits",
+              "Selected proteins", "Draft reactions"]]
+    for point, thresholds in enumerate(grid, 1):
+        selected = ~np.logical_or.reduce(get_hits_masks(hits, *thresholds))
+        selected_genes = np.zeros(len(query_genes), dtype=bool)
+        selected_genes[hits_query_index[selected]] = True
+        nb_reactions = 0
+        if len(reactions_starts):
+            nb_reactions = int(np.logical_or.reduceat(selected_genes[reactions_genes_index], reactions_starts).sum())
+        sweep.append([point, *thresholds, int(selected.sum()), len(np.unique(hits["sseqid"][selected])),
+                      nb_reactions])
+    utils.write_csv(species.directory, "threshold_sweep", sweep, "\t")
+    logging.info("{} : {} threshold combinations evaluated, summary written in {}".format(
+        species.name, len(grid), species.directory + "threshold_sweep.tsv"))
+    for point in drafts or []:
+        try:
+            thresholds = grid[point - 1]
+        except IndexError:
+            print("No threshold combination number %i, skipping it" % point)
+            continue
+        species.identity, species.difference, species.e_val, species.coverage, species.bit_score = thresholds
+        species.gene_dictionary = {}
+        species.draft = cobra.Model(species.name)
+        species.rebuild()
+
+
 def blast_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("main_directory", help="The path to the main directory where the 'files/' directory is stored",
@@ -420,6 +917,21 @@ def blast_arguments():
                         action="store_true")
     parser.add_argument("-rr", "--rerun", help="Use this option if you want to rerun the blast selection on an existing"
                                                " blasted.pkl object. The species' name is expected here", type=str)
+    parser.add_argument("-sw", "--sweep", help="Use this option if you want to evaluate several thresholds' values on "
+                                               "an existing blasted.pkl object. The species' name is expected here",
+                        type=str)
+    parser.add_argument("-swi", "--sweep_identity", help="The identity values to evaluate with --sweep",
+                        type=int, nargs="+")
+    parser.add_argument("-swd", "--sweep_difference", help="The difference values to evaluate with --sweep",
+                        type=int, nargs="+")
+    parser.add_argument("-swev", "--sweep_e_val", help="The e-values to evaluate with --sweep",
+                        type=float, nargs="+")
+    parser.add_argument("-swc", "--sweep_coverage", help="The coverage values to evaluate with --sweep",
+                        type=int, nargs="+")
+    parser.add_argument("-swbs", "--sweep_bit_score", help="The bit-score values to evaluate with --sweep",
+                        type=int, nargs="+")
+    parser.add_argument("-swp", "--sweep_drafts", help="The numbers of the combinations evaluated with --sweep to make "
+                                                       "drafts of (see threshold_sweep.tsv)", type=int, nargs="+")
     parser.add_argument("-n", "--name", help="The future draft's name", type=str)
     parser.add_argument("-m", "--model_file_path", help="Model's file's path, use if 'files/' directory doesn't exist",
                         type=str)
@@ -441,6 +953,13 @@ def blast_arguments():
                         type=int, default=20, choices=range(0, 101), metavar="[0-100]")
     parser.add_argument("-bs", "--bit_score", help="The blast's bit-score threshold value. Default=300",
                         type=int, default=300, choices=range(0, 1001), metavar="[0-1000]")
+    parser.add_argument("-t", "--threads", help="The number of blastp processes launched at the same time, shared by "
+                                                "all the species. Default=number of cores", type=int)
+    parser.add_argument("-bsz", "--batch_size", help="The number of model's genes sent to each blastp process. "
+                                                     "Default=500", type=int, default=500)
+    parser.add_argument("-al", "--aligner", help="The aligner used to compare the model's and subject's proteomes "
+                                                "(its binary must be installed). Default=blastp", type=str,
+                        default="blastp", choices=sorted(aligners.ALIGNERS.keys()))
     args = parser.parse_args()
     return args
 
@@ -456,7 +975,12 @@ def main():
     if args.verbose:
         logging.getLogger().addHandler(logging.StreamHandler())
     logging.info("------ Blasting module started ------")
-    if args.rerun:
+    if args.sweep:
+        sweep_blast_selection(args.main_directory, args.sweep, args.sweep_identity or [args.identity],
+                              args.sweep_difference or [args.difference], args.sweep_e_val or [args.e_val],
+                              args.sweep_coverage or [args.coverage], args.sweep_bit_score or [args.bit_score],
+                              args.sweep_drafts)
+    elif args.rerun:
         rerun_blast_selection(args.main_directory, args.rerun, args.identity, args.difference, args.e_val,
                               args.coverage, args.bit_score)
     elif args.unique:
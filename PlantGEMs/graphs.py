@@ -1,64 +1,41 @@
 import cobra
-import copy
 import matplotlib.pyplot as plt
 
 from upsetplot import from_memberships, plot
 
-from utils import get_list_ids_reactions_cobra, cobra_compatibility, find_files, write_file
+from utils import get_list_ids_reactions_cobra, cobra_compatibility, find_files
 
 
-def get_clusters(cluster_list):
-    """Function to create every individual cluster depending on
-    the number of values given to the UpSetPlot function.
+def get_memberships(data):
+    """Function to find, in a single pass over the data, the sets each element belongs to. The membership of an element
+    is stored as a bitmask : bit i is set if the element is in the i-th set of data.
 
     PARAMS:
-        cluster_list (list) -- the list of subjects for the upSetPlot.
+        data -- the dictionary containing the organisms as keys
+        and the genes/reactions/others to treat for the UpSetPlot.
 
     RETURNS:
-        final_res (list of lists) -- a list of all the possible clusters.
+        intersections (dict) -- the elements of each non-empty intersection {bitmask (int): [elements]}.
     """
 
-    res = []
-    final_res = []
-    for i in range(len(cluster_list) - 1):
-        if i == 0:
-            for x in cluster_list:
-                z = cluster_list.index(x)
-                for j in range(len(cluster_list) - z - 1):
-                    res.append([x, cluster_list[z + j + 1]])
-            [final_res.append(k) for k in res]
-        else:
-            res = get_sub_clusters(cluster_list, res)
-            [final_res.append(r) for r in res]
-    return final_res
-
-
-def get_sub_clusters(cluster_list, res):
-    """Sub-function of the clusters (algorithmic architecture)."""
-
-    sub_res = []
-    for y in res:
-        z = cluster_list.index(y[len(y) - 1])
-        for i in range(z + 1, len(cluster_list)):
-            x = copy.deepcopy(y)
-            x.append(cluster_list[i])
-            sub_res.append(x)
-    return sub_res
-
-
-def similarity_count(data, args, others):
-    """Function which is part of the process to make the UpSetPlot,
-    counting and returning the similarities between the clusters."""
-
-    cluster_set = set.intersection(*args)
-    for i in others:
-        cluster_set = cluster_set.difference(set(data[i]))
-    return cluster_set, len(cluster_set)
+    memberships = {}
+    for i, key in enumerate(data.keys()):
+        bit = 1 << i
+        for element in data[key]:
+            memberships[element] = memberships.get(element, 0) | bit
+    intersections = {}
+    for element, mask in memberships.items():
+        try:
+            intersections[mask].append(element)
+        except KeyError:
+            intersections[mask] = [element]
+    return intersections
 
 
 def make_upsetplot(directory, name, data, title, remove_zero=True, show_plot=False):
     """Function to make an UpSetPlot.
-    Need this three other functions : similarity_count(), get_clusters(), get_sub_clusters().
+    The intersections are computed by get_memberships(), only the non-empty ones are counted unless remove_zero is
+    False, and the elements of each intersection are written in the .log file as they are browsed.
 
     PARAMS:
         directory (str) -- the directory to save the result.
@@ -70,31 +47,28 @@ def make_upsetplot(directory, name, data, title, remove_zero=True, show_plot=Fal
         show_plot (boolean) -- True if you want a graph to pop.
     """
 
-    clusters = get_clusters(list(data.keys()))
-    [clusters.insert(0, [key]) for key in data.keys()]
-    count = []
-    log = ""
-    for c in clusters:
-        others = list(data.keys())
-        list_inter = []
-        for x in c:
-            others.remove(x)
-            list_inter.append(set(data[x]))
-        cluster_data, sim_count = similarity_count(data, list_inter, others)
-        count.append(sim_count)
-        for i in c:
-            log += i + " "
-        log += " (" + str(sim_count) + ") :\n\n"
-        for i in cluster_data:
-            log += cobra_compatibility(str(i)) + "\n"
-        log += "\n------\n\n"
-    write_file(directory + name + ".log", log, False)
-    # removing 0 values
+    keys = list(data.keys())
+    intersections = get_memberships(data)
     if remove_zero:
-        while 0 in count:
-            x = count.index(0)
-            count.pop(x)
-            clusters.pop(x)
+        masks = list(intersections.keys())
+    else:
+        masks = list(range(1, 1 << len(keys)))
+    masks.sort(key=lambda m: (bin(m).count("1"), m))
+    clusters = []
+    count = []
+    with open(directory + name + ".log", "w") as log:
+        for mask in masks:
+            cluster = [keys[i] for i in range(len(keys)) if mask >> i & 1]
+            cluster_data = intersections.get(mask, [])
+            clusters.append(cluster)
+            count.append(len(cluster_data))
+            log.write(" ".join(cluster) + "  (" + str(len(cluster_data)) + ") :\n\n")
+            for i in cluster_data:
+                log.write(cobra_compatibility(str(i)) + "\n")
+            log.write("\n------\n\n")
+    if not clusters:
+        print("Nothing to plot for " + name + ", every set is empty")
+        return
     my_upsetplot = from_memberships(clusters, count)
     plot(my_upsetplot, show_counts='%d', totals_plot_elements=3)
     plt.suptitle(title)
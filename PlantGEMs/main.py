@@ -7,30 +7,84 @@
 
 """This file is the main, calling the others files to create an entirely new metabolic network."""
 
+import aligners
 import argparse
 import blasting
 import logging
 import merging
 import mpwting
+import multiprocessing
+import sys
 import utils
 
 
 def run(args):
+    """Function to create the new metabolic networks. Each step of each species is a task of a graph (see
+    utils.run_task_graph()), launched as soon as the tasks it depends on are done and the cores and memory allow it :
+        - blast <species> : the blast, the genes' selection and the drafting of the species. The aligner processes of
+        all the blasts share the same slots (see blasting.Blasting._blast_run()), so that the cores left by a species
+        whose blast is done are taken by the others.
+        - mpwt input <species> : the Pathway Tools' input files of the species.
+        - pathologic <species> : the PathoLogic reconstruction of the species, after its mpwt input.
+        - migrate <species> : the copy of the draft and the .dat files in the merge directory, after its blast and its
+        PathoLogic reconstruction.
+        - merge <species> : the merging of the species, after its migrate.
+    So the blasts and the PathoLogic reconstructions run at the same time and each species is merged as soon as its
+    own blast and PathoLogic reconstruction are done.
+    Each stage (blast, select, draft, mpwt_input, pathologic, migrate and merge) writes a completion record in
+    stages/<species>/ (see module.Module._is_stage_done()), so that running it again skips the stages up to date and
+    resumes each species at its first stale or failed stage.
+    """
+
     print("Proceeding to create all the needed files and checking input files, please stay around...")
     # Launching the first part of Blast (files checking & folder generation)
     list_objects_to_blast = blasting.blast_multirun_first(args)
+    if not list_objects_to_blast:
+        log_message = "No species found in : " + args.main_directory + "main.ini"
+        logging.error(log_message)
+        sys.exit(log_message)
     # Launching the first part of MPWT (files checking & folder generation)
-    list_objects, cpu, input_directory, output_directory, log_directory = \
-        mpwting.mpwt_multirun_first(args.main_directory)
-
-    # Then, launching the rest of the run in multiprocess without the need of any input from the user
-    print("Everything's fine, now launching BLAST and then MPWT processes, it may take some time...")
-    blasting.blast_multirun_last(list_objects_to_blast)
-    mpwting.mpwt_multirun_last(list_objects, cpu, input_directory, output_directory, log_directory)
+    list_objects_to_mpwt = mpwting.mpwt_multirun_first(args.main_directory)[0]
+    utils.make_directory(args.main_directory + "merge/")
+    list_objects_to_merge = [merging.Merging(organism.name, args.main_directory) for organism in list_objects_to_blast]
 
-    # Merging all the new drafts and pathway tools pgdbs for each organism
-    utils.migrate(args.main_directory)
-    merging.run(args.main_directory)
+    # Then, launching the rest of the run without the need of any input from the user
+    cpu = args.threads or multiprocessing.cpu_count()
+    memory = int(args.memory * 1024 ** 3) if args.memory else utils.get_available_memory()
+    # One core is left for each species' PathoLogic reconstruction (or mpwt input before it), the others are the slots
+    # of the aligner processes, shared by the blasts of all the species
+    nb_species = len(list_objects_to_blast)
+    blast_cpu = max(1, cpu - nb_species)
+    graph_cpu = max(1, cpu - blast_cpu)
+    input_cpu = max(1, graph_cpu // nb_species)
+    blast_slots = multiprocessing.Semaphore(blast_cpu)
+    nodes = {}
+    for organism in list_objects_to_mpwt:
+        input_memory = organism._get_memory_estimate() * input_cpu
+        nodes["mpwt input " + organism.name] = (mpwting.build_mpwt_input, (organism, input_cpu, input_memory),
+                                                [], input_cpu, input_memory)
+    for organism in list_objects_to_mpwt:
+        nodes["pathologic " + organism.name] = (mpwting.run_pathologic, (organism,),
+                                                ["mpwt input " + organism.name], 1, mpwting.PATHOLOGIC_MEMORY)
+    for organism in list_objects_to_blast:
+        organism.threads = blast_cpu
+        # No core taken in the graph, the blast's aligner processes take the blast slots
+        nodes["blast " + organism.name] = (blasting.build_blast_objects, (organism, blast_slots), [], 0, 0)
+    for organism in list_objects_to_merge:
+        nodes["migrate " + organism.name] = (merging.migrate_merge_objects, (organism,),
+                                             ["blast " + organism.name, "pathologic " + organism.name], 1, 0)
+        nodes["merge " + organism.name] = (merging.build_merge_objects, (organism,), ["migrate " + organism.name], 1,
+                                           organism._get_memory_estimate)
+    print("Everything's fine, now launching the BLAST, MPWT and merging processes, it may take some time...")
+    old_pathway_score = mpwting.set_pathway_score(mpwting.PATHWAY_SCORE)
+    try:
+        failed = utils.run_task_graph(nodes, graph_cpu, memory)
+    finally:
+        mpwting.restore_pathway_score(old_pathway_score)
+    if failed:
+        log_message = "Failed or not launched : " + ", ".join(failed)
+        logging.error(log_message)
+        sys.exit(log_message)
 
 
 def main_arguments():
@@ -52,6 +106,15 @@ def main_arguments():
                         type=int, default=20, choices=range(0, 101), metavar="[0-100]")
     parser.add_argument("-bs", "--bit_score", help="The blast's bit-score threshold value. Default=300",
                         type=int, default=300, choices=range(0, 1001), metavar="[0-1000]")
+    parser.add_argument("-t", "--threads", help="The number of cores shared by the blast, mpwt and merging processes "
+                                                "running at the same time. Default=number of cores", type=int)
+    parser.add_argument("-bsz", "--batch_size", help="The number of model's genes sent to each blastp process. "
+                                                     "Default=500", type=int, default=500)
+    parser.add_argument("-al", "--aligner", help="The aligner used to compare the model's and subject's proteomes "
+                                                "(its binary must be installed). Default=blastp", type=str,
+                        default="blastp", choices=sorted(aligners.ALIGNERS.keys()))
+    parser.add_argument("-mem", "--memory", help="The memory (Gb) that the blast, mpwt and merging processes running "
+                                                 "at the same time can use. Default=memory available", type=float)
     args = parser.parse_args()
     return args
 
@@ -10,11 +10,11 @@ mpwt package."""
 
 import argparse
 import cobra
-import copy
+import json
 import logging
-import multiprocessing
 import os
 import re
+import sys
 
 from datetime import date
 
@@ -23,6 +23,74 @@ import module
 import utils
 
 
+MEMORY_FACTOR = 10
+METACYC_STORES = {}
+
+
+class MetacycStore:
+    """Read-only access to the Metacyc reactions and to the correspondence between their short and long IDs. The JSON
+    model is only indexed (see utils.get_json_model_index()) and a reaction, with its metabolites, is built from its
+    record when asked for, so that only the reactions used by a species are loaded. The store is loaded once per
+    process and shared by all the Merging objects : the workers of merging_multirun_last() inherit the one loaded by
+    the parent process when they are forked, so that it is neither loaded again nor pickled."""
+
+    def __init__(self, metacyc_file_path):
+        self.metacyc_file_path = metacyc_file_path
+        self.index = utils.get_json_model_index(metacyc_file_path)
+        self._records_file = None
+        self._records_file_pid = None
+        files_directory = os.path.dirname(metacyc_file_path) + "/"
+        if not os.path.isfile(files_directory + "metacyc_ids.tsv"):
+            utils.get_metacyc_ids(metacyc_file_path)
+        metacyc_ids_file_path = utils.find_file(files_directory, "metacyc_ids", "tsv")
+        self.matching_id_dict, self.matching_id_dict_reversed = utils.build_correspondence_dict(metacyc_ids_file_path)
+
+    def _read_record(self, key, record_id):
+        """Returns the record (dict) of a reaction or a metabolite (key = "reactions" or "metabolites"). The records
+        file is opened once per process, a forked process must not share the position in the file of its parent."""
+
+        if self._records_file is None or self._records_file_pid != os.getpid():
+            self._records_file = open(self.metacyc_file_path + ".records", "rb")
+            self._records_file_pid = os.getpid()
+        offset, size = self.index[key][record_id]
+        self._records_file.seek(offset)
+        return json.loads(self._records_file.read(size))
+
+    def get_reaction(self, reaction_id, metabolites):
+        """Returns a new cobra reaction built from the Metacyc's one, without any gene. Its metabolites are created
+        only once and stored in the metabolites dictionary {metabolite ID: cobra metabolite} (see
+        utils.copy_reaction()). Raises a KeyError if the reaction is not in Metacyc."""
+
+        record = self._read_record("reactions", reaction_id)
+        reaction = cobra.Reaction()
+        for key, value in record.items():
+            if key in ["lower_bound", "upper_bound"]:
+                setattr(reaction, key, float(value))
+            elif key not in ["metabolites", "gene_reaction_rule", "objective_coefficient", "reversibility",
+                             "reaction"]:
+                setattr(reaction, key, value)
+        stoichiometry = {}
+        for metabolite_id, coefficient in record["metabolites"].items():
+            if metabolite_id not in metabolites.keys():
+                metabolite = cobra.Metabolite()
+                for key, value in self._read_record("metabolites", metabolite_id).items():
+                    setattr(metabolite, key, value)
+                metabolites[metabolite_id] = metabolite
+            stoichiometry[metabolites[metabolite_id]] = coefficient
+        reaction.add_metabolites(stoichiometry)
+        return reaction
+
+
+def get_metacyc_store(metacyc_file_path):
+    """Function to get the MetacycStore of a Metacyc file, loaded only at the first call in the process."""
+
+    try:
+        return METACYC_STORES[metacyc_file_path]
+    except KeyError:
+        METACYC_STORES[metacyc_file_path] = MetacycStore(metacyc_file_path)
+        return METACYC_STORES[metacyc_file_path]
+
+
 class Merging(module.Module):
 
     def __init__(self, _name, _main_directory):
@@ -32,19 +100,28 @@ class Merging(module.Module):
         self.files_directory = self.main_directory + "files/"
         self.pwt_reactions_id_list = []
         self.pwt_metacyc_reactions_id_list = []
+        self.pwt_reactions_list = []
         self.json_reactions_list = []
         self.sbml_reactions_list = []
         self.dict_upsetplot_reactions = {}
+        self.pwt_dat_index = None
         self.merged_model = cobra.Model(self.name, name=self.name + "_PlantGEMs_" + str(date.today()))
 
-        # Metacyc files
+        # Metacyc files, loaded once per process and shared by all the objects (see get_metacyc_store())
         self.metacyc_file_path = utils.find_file(self.files_directory, "metacyc", "json")
-        self.metacyc_model = cobra.io.load_json_model(self.metacyc_file_path)
-        if not os.path.isfile(self.files_directory + "metacyc_ids.tsv"):
-            utils.get_metacyc_ids(self.metacyc_file_path)
-        self.metacyc_ids_file_path = utils.find_file(self.files_directory, "metacyc_ids", "tsv")
-        self.metacyc_matching_id_dict, self.metacyc_matching_id_dict_reversed = \
-            utils.build_correspondence_dict(self.metacyc_ids_file_path)
+        get_metacyc_store(self.metacyc_file_path)
+
+    @property
+    def metacyc_store(self):
+        return get_metacyc_store(self.metacyc_file_path)
+
+    @property
+    def metacyc_matching_id_dict(self):
+        return self.metacyc_store.matching_id_dict
+
+    @property
+    def metacyc_matching_id_dict_reversed(self):
+        return self.metacyc_store.matching_id_dict_reversed
 
     def _search_metacyc_reactions_ids(self):
         """Function to search the reactions' ids for in the flat files from a Pathway Tools reconstruction. Then, adds
@@ -127,88 +204,90 @@ class Merging(module.Module):
         logging.info("{} : Number of reactions found in the Pathway Tools reconstruction files : {}".format(self.name,
                                                                                                             count))
 
+    def _read_pwt_dat_file(self, file_name, attribute):
+        """Function to read a Pathway Tools' .dat file once and gather, for each entry, the values of one of its
+        attributes.
+
+        PARAMS:
+            file_name (str) -- the name of the .dat file in the object's directory.
+            attribute (str) -- the attribute to gather (e.g.: "ENZYMATIC-REACTION").
+        RETURNS:
+            dat_index (dict) -- {UNIQUE-ID (str): [values of the attribute (str)]}, the first entry being kept if an
+            UNIQUE-ID is found several times.
+        """
+
+        unique_id_pattern = re.compile('(?<=UNIQUE-ID - )[+-]*\w+(.*\w+)*(-*\w+)*')
+        attribute_pattern = re.compile('(?<=' + attribute + ' - )[+-]*\w+(.*\w+)*(-*\w+)*')
+        dat_index = {}
+        values = None
+        with open(self.directory + file_name, "r") as dat_file:
+            for line in dat_file:
+                if "#" in line:
+                    continue
+                if "UNIQUE-ID" in line:
+                    try:
+                        unique_id = unique_id_pattern.search(line).group(0).rstrip()
+                        values = [] if unique_id in dat_index.keys() else dat_index.setdefault(unique_id, [])
+                    except AttributeError:
+                        logging.error("{} : No UNIQUE-ID match for {} : {}".format(self.name, file_name, line))
+                        values = None
+                elif values is not None and attribute + " " in line:
+                    try:
+                        values.append(attribute_pattern.search(line).group(0).rstrip())
+                    except AttributeError:
+                        logging.error("{} : No {} match for {} : {}".format(self.name, attribute, file_name, line))
+        return dat_index
+
+    def _get_pwt_dat_index(self):
+        """Function to get the links between the reactions, their enzymatic reactions, the enzymes and their genes
+        found in the reactions.dat, enzrxns.dat and proteins.dat files. The index is cached next to the .dat files
+        (pwt_dat_index.pkl) with their content hashes, so that they are read only once.
+
+        RETURNS:
+            pwt_dat_index (dict) -- {"reactions": {reaction: [enzymatic reactions]}, "enzrxns": {enzymatic reaction:
+            [enzymes]}, "proteins": {enzyme: [genes]}}.
+        """
+
+        dat_files = {"reactions": ("reactions.dat", "ENZYMATIC-REACTION"), "enzrxns": ("enzrxns.dat", "ENZYME"),
+                     "proteins": ("proteins.dat", "GENE")}
+        dat_hashes = {key: utils.get_file_hash(self.directory + dat_file[0]) for key, dat_file in dat_files.items()}
+        cache = utils.load_obj(self.directory + "pwt_dat_index.pkl")
+        if cache and cache["hashes"] == dat_hashes:
+            return cache["index"]
+        pwt_dat_index = {key: self._read_pwt_dat_file(*dat_file) for key, dat_file in dat_files.items()}
+        utils.save_obj({"hashes": dat_hashes, "index": pwt_dat_index}, self.directory + "pwt_dat_index")
+        return pwt_dat_index
+
     def _browse_pwt_dat_files(self, reaction):
         """Function to correct the gene reaction rule in each reaction taken from Metacyc/Pathway Tools
-        to make it fit the organism for which the model is reconstructed.
+        to make it fit the organism for which the model is reconstructed. The genes are found through the index of the
+        .dat files (see _get_pwt_dat_index()) : reaction -> enzymatic reactions -> enzyme -> genes.
 
         PARAMS:
             reaction: the reaction's gene reaction rule to change.
         Returns the corrected gene reaction rule.
+        RAISES:
+            KeyError -- if the reaction has no short ID in metacyc_matching_id_dict_reversed.
         """
 
-        reactions_file = utils.read_file_listed(self.directory + "/reactions.dat")
-        enzrxns_file = utils.read_file_listed(self.directory + "/enzrxns.dat")
-        proteins_file = utils.read_file_listed(self.directory + "/proteins.dat")
-
-        # First step : gathering the ENZYME-REACTION fields in enzrxns (could be several or none for one ID).
-        stop = False
-        enzrxns = []
-        unique_id = ""
-        for reaction_line in reactions_file:
-            if "UNIQUE-ID" in reaction_line and "#" not in reaction_line:
-                if stop:
-                    break
-                try:
-                    unique_id = re.search('(?<=UNIQUE-ID - )[+-]*\w+(.*\w+)*(-*\w+)*', reaction_line).group(0).rstrip()
-                    if unique_id == reaction.name or unique_id == self.metacyc_matching_id_dict_reversed[reaction.name]:
-                        stop = True
-                except AttributeError:
-                    logging.error("{} : No UNIQUE-ID match for reactions.dat : {}".format(self.name, reaction_line))
-            if stop and "ENZYMATIC-REACTION " in reaction_line and "#" not in reaction_line:
-                try:
-                    enzrxns.append(re.search('(?<=ENZYMATIC-REACTION - )[+-]*\w+(.*\w+)*(-*\w+)*',
-                                             reaction_line).group(0).rstrip())
-                except AttributeError:
-                    logging.error("{} : No ENZYMATIC-REACTION match for reactions.dat : {}".format(self.name,
-                                                                                                   reaction_line))
-
-        # Second step : getting the corresponding ENZYME for each ENZYME-REACTION.
-        stop = False
+        if self.pwt_dat_index is None:
+            self.pwt_dat_index = self._get_pwt_dat_index()
+        # A reaction without a short ID raises a KeyError, it isn't kept (see _correct_pwt_reactions())
+        short_id = self.metacyc_matching_id_dict_reversed[reaction.name]
+        unique_id = reaction.name
+        enzrxns = self.pwt_dat_index["reactions"].get(unique_id)
+        if enzrxns is None:
+            unique_id = short_id
+            enzrxns = self.pwt_dat_index["reactions"].get(unique_id, [])
         gene_list = []
-        enzyme = ""
         no_match_enzrxns = []
         if enzrxns:
             for enzrxn in enzrxns:
-                for line_enzrxn in enzrxns_file:
-                    if "UNIQUE-ID" in line_enzrxn and "#" not in line_enzrxn:
-                        if stop:
-                            stop = False
-                            break
-                        try:
-                            unique_id_rxn = re.search('(?<=UNIQUE-ID - )[+-]*\w+(.*\w+)*(-*\w+)*', line_enzrxn).group(
-                                0).rstrip()
-                            if unique_id_rxn == enzrxn:
-                                stop = True
-                        except AttributeError:
-                            logging.error("{} : No UNIQUE-ID match for enzrxns.dat : {}".format(self.name, line_enzrxn))
-                    if stop and "ENZYME " in line_enzrxn and "#" not in line_enzrxn:
-                        try:
-                            enzyme = re.search('(?<=ENZYME - )[+-]*\w+(.*\w+)*(-*\w+)*', line_enzrxn).group(0).rstrip()
-                        except AttributeError:
-                            logging.error("{} : No ENZYME match for enzrxns.dat : {}".format(self.name, line_enzrxn))
-                # Third step into the second one : getting the corresponding GENE for each ENZYME and put it into
-                # geneList (which contains all that we're looking for).
-                for lineProt in proteins_file:
-                    if "UNIQUE-ID " in lineProt and "#" not in lineProt:
-                        if stop:
-                            stop = False
-                            break
-                        try:
-                            unique_id_prot = re.search('(?<=UNIQUE-ID - )[+-]*\w+(.*\w+)*(-*\w+)*', lineProt).group(
-                                0).rstrip()
-                            if unique_id_prot == enzyme:
-                                stop = True
-                        except AttributeError:
-                            logging.error("No UNIQUE-ID match for proteins.dat : {}".format(lineProt))
-                    if stop and "GENE " in lineProt and "#" not in lineProt:
-                        try:
-                            gene_list.append(
-                                re.search('(?<=GENE - )[+-]*\w+(.*\w+)*(-*\w+)*', lineProt).group(0).rstrip())
-                        except AttributeError:
-                            logging.error("No GENE match for proteins.dat : {}".format(lineProt))
+                enzymes = self.pwt_dat_index["enzrxns"].get(enzrxn)
+                if enzymes:  # The last ENZYME of the entry is the one kept
+                    gene_list.extend(self.pwt_dat_index["proteins"].get(enzymes[-1], []))
         else:
             no_match_enzrxns.append(unique_id)
-            pass
         reaction.gene_reaction_rule = " or ".join(set(gene_list))
         return reaction, [reaction.name, len(enzrxns)], no_match_enzrxns
 
@@ -222,6 +301,7 @@ class Merging(module.Module):
         """
 
         count = 0
+        metabolites = {}
         list_no_match_correction = []
         list_no_match_enzrxns = []
         list_match_nb_enzymatic_reactions = []
@@ -238,12 +318,12 @@ class Merging(module.Module):
                                            '9']:  # Another Metacyc ids' specificity
                         reaction_id2 = "_" + reaction_id2
                     try:
-                        added_reaction = copy.deepcopy(self.metacyc_model.reactions.get_by_id(reaction_id2))
+                        added_reaction = self.metacyc_store.get_reaction(reaction_id2, metabolites)
                         added_reaction_corrected, tuple_nb_enzymatic_reactions_match, no_match_enzrxns = \
                             self._browse_pwt_dat_files(added_reaction)
                         list_match_nb_enzymatic_reactions.append(tuple_nb_enzymatic_reactions_match)
                         list_no_match_enzrxns.extend(no_match_enzrxns)
-                        self.merged_model.add_reactions([added_reaction_corrected])
+                        self.pwt_reactions_list.append(added_reaction_corrected)
                     except KeyError:
                         list_no_match_correction.append(reaction_id2)
                         pass
@@ -259,61 +339,121 @@ class Merging(module.Module):
                      format(self.name, "\n".
                             join([(str(i[0]) + " : " + str(i[1])) for i in list_match_nb_enzymatic_reactions])))
 
-    def _conservative_merging(self, merging_reactions_list):
+    def _conservative_merging(self, merging_reactions_list, merged_reactions, merged_genes):
         """
-        Function to merge reactions in the merging_reactions_list that are already in the merged model taking care of
-        keeping every gene of the gene reaction rule, either from the merged model or the reactions' list. Just adds the
-        reactions that were not already present.
+        Function to merge reactions in the merging_reactions_list that are already in the merged reactions taking care
+        of keeping every gene of the gene reaction rule, either from the merged reactions or the reactions' list. Just
+        adds the reactions that were not already present (the first one is kept if an ID is found several times in the
+        list). The reactions are keyed by ID, so that each reaction of the list is merged in constant time.
 
         PARAMS:
-            merging_reactions_list (cobra list reactions) -- list of cobra reactions you want to merge to the object's
-            model.
-        RETURNS:
-            a list of reactions that are not already in the merged_model
+            merging_reactions_list (cobra list reactions) -- list of cobra reactions you want to merge.
+            merged_reactions (dict) -- the reactions merged so far {reaction ID: cobra reaction}, completed by the
+            function.
+            merged_genes (dict) -- the genes of each merged reaction {reaction ID: {gene (str): None}} (a dict keeps the
+            genes' order), completed by the function.
         """
 
-        temp_model = cobra.Model("temp_" + self.name)
+        merging_reactions_ids = set()
         for reaction in merging_reactions_list:
-            temp_model.add_reactions([reaction])
-        merging_reactions_list_ids = utils.get_list_ids_reactions_cobra(temp_model)
-        for reaction in self.merged_model.reactions:
-            if reaction.id in merging_reactions_list_ids:
-                list_genes = reaction.gene_reaction_rule.split(" or ")
-                list_genes.extend(temp_model.reactions.get_by_id(reaction.id).gene_reaction_rule.split(" or "))
-                list_genes = list(filter(None, set(list_genes)))
-                reaction.gene_reaction_rule = " or ".join(list_genes)
-                temp_model.remove_reactions([reaction.id])
-        self.merged_model.add_reactions(utils.get_list_reactions_cobra(temp_model))
+            if reaction.id in merging_reactions_ids:
+                continue
+            merging_reactions_ids.add(reaction.id)
+            genes = merged_genes.get(reaction.id)
+            if genes is None:
+                merged_reactions[reaction.id] = reaction
+                genes = merged_genes[reaction.id] = {}
+            for gene in reaction.gene_reaction_rule.split(" or "):
+                if gene:
+                    genes.setdefault(sys.intern(gene), None)
 
     def _merge(self):
         """Function to merge models, either from a model-based reconstruction (blasting module) or from
-        Pathway Tools's Pathologic software."""
+        Pathway Tools's Pathologic software. The reactions are merged by ID (see _conservative_merging()) and the
+        merged model is built at once at the end."""
 
+        merged_reactions = {}
+        merged_genes = {}
         self._correct_pwt_reactions()
+        self._conservative_merging(self.pwt_reactions_list, merged_reactions, merged_genes)
         logging.info("{} : network size with only Pathway Tools' reactions : {}".format(self.name, len(
-            self.merged_model.reactions)))
-        self._conservative_merging(self.json_reactions_list)
+            merged_reactions)))
+        self._conservative_merging(self.json_reactions_list, merged_reactions, merged_genes)
         logging.info("{} : network size with the addition of JSON's reactions : {}".format(self.name, len(
-            self.merged_model.reactions)))
-        self._conservative_merging(self.sbml_reactions_list)
+            merged_reactions)))
+        self._conservative_merging(self.sbml_reactions_list, merged_reactions, merged_genes)
         logging.info("{} : network size with the addition of SBML's reactions : {}".format(self.name, len(
-            self.merged_model.reactions)))
+            merged_reactions)))
+        for reaction_id, reaction in merged_reactions.items():
+            gene_reaction_rule = " or ".join(merged_genes[reaction_id])
+            if gene_reaction_rule != reaction.gene_reaction_rule:
+                reaction.gene_reaction_rule = gene_reaction_rule
+        self.merged_model.add_reactions(list(merged_reactions.values()))
+
+    def _get_memory_estimate(self):
+        """Returns the estimated memory (bytes) needed to merge this species : the cobra objects take about ten times
+        the size of the files they are read from, i.e. the species' files (drafts, models and .dat files) and the part
+        of Metacyc used by Pathway Tools (about a third of it)."""
+
+        files_size = sum(os.path.getsize(self.directory + file) for file in os.listdir(self.directory)
+                         if os.path.isfile(self.directory + file))
+        return MEMORY_FACTOR * (files_size + os.path.getsize(self.metacyc_file_path) // 3)
+
+    def _get_stage_fingerprint(self, stage):
+        """Returns the fingerprint of the inputs of a stage : migrate (the blast draft and the .dat files copied in the
+        merge directory) or merge (the drafts, models and .dat files of the merge directory and Metacyc), see
+        module.Module._is_stage_done()."""
+
+        if stage == "migrate":
+            mpwt_output_directory = self.main_directory + "mpwt/output/" + self.name + "/"
+            return self._get_fingerprint({"blast_draft": self.main_directory + "blast/" + self.name + "/" + self.name +
+                                          "_blast_draft.json",
+                                          "reactions": mpwt_output_directory + "reactions.dat",
+                                          "proteins": mpwt_output_directory + "proteins.dat",
+                                          "enzrxns": mpwt_output_directory + "enzrxns.dat"})
+        input_paths = {file: self.directory + file for file in sorted(os.listdir(self.directory))
+                       if file.endswith((".json", ".sbml", ".dat")) and file != self.name + "_merged.json"}
+        input_paths["metacyc"] = self.metacyc_file_path
+        return self._get_fingerprint(input_paths)
+
+    def migrate(self):
+        """Function to copy the blast draft and the .dat files of the species in its merge directory (see
+        utils.migrate_species()), if its migrate stage isn't up to date."""
+
+        fingerprint = self._get_stage_fingerprint("migrate")
+        if self._is_stage_done("migrate", fingerprint):
+            logging.info("{} : Migrate stage up to date, the files are kept".format(self.name))
+            return
+        self._start_stage("migrate")
+        utils.migrate_species(self.main_directory, self.name)
+        self._save_stage_record("migrate", fingerprint, [self.directory + self.name + "_blast_draft.json",
+                                                         self.directory + "reactions.dat",
+                                                         self.directory + "proteins.dat",
+                                                         self.directory + "enzrxns.dat"])
 
     def build(self):
-        """Function to call the method in correct order for a complete merging."""
-
+        """Function to call the method in correct order for a complete merging, if the merge stage isn't up to date
+        (see module.Module._is_stage_done())."""
+
+        utils.check_path(self.directory, sys_exit=True)
+        fingerprint = self._get_stage_fingerprint("merge")
+        if self._is_stage_done("merge", fingerprint):
+            logging.info("{} : Merge stage up to date, the merged model is kept".format(self.name))
+            print(self.name + " : Merge stage up to date, the merged model is kept")
+            return
+        self._start_stage("merge")
         if utils.check_path(self.directory + "reactions.dat"):
             self._get_pwt_reactions()
             self._search_metacyc_reactions_ids()
         else:
             logging.info("{} : No .dat files found, proceeding with drafts and models only.".format(self.name))
-        if utils.check_path(self.directory, sys_exit=True):
-            self._get_networks_reactions("json")
-            self._get_networks_reactions("sbml")
+        self._get_networks_reactions("json")
+        self._get_networks_reactions("sbml")
         self._merge()
         cobra.io.save_json_model(self.merged_model, self.directory + self.name + "_merged.json")
         graphs.make_upsetplot(self.directory, self.name + "_merging_upsetplot", self.dict_upsetplot_reactions,
                               "Intersection of different sources' reactions")
+        self._save_stage_record("merge", fingerprint, [self.directory + self.name + "_merged.json"])
 
 
 def merging_multirun_first(main_directory):
@@ -328,14 +468,18 @@ def merging_multirun_first(main_directory):
     return list_objects
 
 
-def merging_multirun_last(list_objects):
+def merging_multirun_last(list_objects, memory=None):
     """
-    Split of major function 'run', second part = launches the process on each given object with multiprocessing.
+    Split of major function 'run', second part = launches the process on each given object with multiprocessing, as
+    many at the same time as the cores and the memory allow (see utils.run_tasks()).
+
+    PARAMS:
+        list_objects (list) -- the Merging objects.
+        memory (int) -- the memory budget in bytes (default = memory available).
     """
 
-    cpu = len(list_objects)
-    p = multiprocessing.Pool(cpu)
-    p.map(build_merge_objects, list_objects)
+    utils.run_tasks(build_merge_objects, list_objects, [organism._get_memory_estimate() for organism in list_objects],
+                    [organism.name for organism in list_objects], memory=memory)
 
 
 def build_merge_objects(organism):
@@ -344,10 +488,16 @@ def build_merge_objects(organism):
     organism.build()
 
 
-def run(main_directory):
+def migrate_merge_objects(organism):
+    """Small function required for the multiprocessing migration."""
+
+    organism.migrate()
+
+
+def run(main_directory, memory=None):
     utils.check_path(main_directory)
     list_objects = merging_multirun_first(main_directory)
-    merging_multirun_last(list_objects)
+    merging_multirun_last(list_objects, memory)
 
 
 def merging_arguments():
@@ -360,6 +510,8 @@ def merging_arguments():
     parser.add_argument("-v", "--verbose", help="Toggle the printing of more information", action="store_true")
     parser.add_argument("-le", "--log_erase", help="Erase the existing log file to create a brand new one",
                         action="store_true")
+    parser.add_argument("-mem", "--memory", help="The memory (Gb) that the species merged at the same time can use. "
+                                                 "Default=memory available", type=float)
     args = parser.parse_args()
     return args
 
@@ -377,7 +529,7 @@ def main():
     if args.migrate:
         utils.migrate(utils.slash(args.main_directory))
     logging.info("------ Merging module started ------")
-    run(utils.slash(args.main_directory))
+    run(utils.slash(args.main_directory), int(args.memory * 1024 ** 3) if args.memory else None)
 
 
 if __name__ == "__main__":
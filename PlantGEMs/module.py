@@ -8,6 +8,7 @@
 """This file is the parent class for all the modules, inherited by each of them to centralize repetitive methods."""
 
 
+import json
 import os
 
 import utils
@@ -19,6 +20,79 @@ class Module:
         self.name = _name
         self.main_directory = _main_directory.rstrip("/ ") + "/"
 
+    def _get_fingerprint(self, input_paths, parameters=None):
+        """Function to make the fingerprint of a stage : the content hashes of its input files and its parameters.
+
+        PARAMS:
+            input_paths (dict) -- {input name: path} of the input files, a missing file gets a None hash.
+            parameters (dict) -- the parameters of the stage (JSON types).
+        RETURNS:
+            fingerprint (dict) -- {"inputs": {input name: hash}, "parameters": parameters}.
+        """
+
+        return {"inputs": {name: utils.get_file_hash(path) if os.path.isfile(path) else None
+                           for name, path in input_paths.items()},
+                "parameters": parameters or {}}
+
+    def _get_stage_record_path(self, stage):
+        return self.main_directory + "stages/" + self.name + "/" + stage + ".json"
+
+    def _get_stage_record(self, stage):
+        """Returns the completion record of a stage of this species (see _save_stage_record()), None if absent."""
+
+        try:
+            with open(self._get_stage_record_path(stage), "r") as record_file:
+                return json.load(record_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _is_stage_done(self, stage, fingerprint):
+        """Function to check if a stage of this species can be skipped : its completion record must have the same
+        fingerprint (see _get_fingerprint()) and the files it made must not have changed since.
+
+        PARAMS:
+            stage (str) -- the name of the stage.
+            fingerprint (dict) -- the current fingerprint of the stage's inputs and parameters.
+        RETURNS:
+            True if the stage is up to date, False otherwise.
+        """
+
+        record = self._get_stage_record(stage)
+        if record is None or record["fingerprint"] != json.loads(json.dumps(fingerprint)):
+            return False
+        for path, file_hash in record["outputs"].items():
+            if not os.path.isfile(self.main_directory + path) or \
+                    utils.get_file_hash(self.main_directory + path) != file_hash:
+                return False
+        return True
+
+    def _start_stage(self, stage):
+        """Removes the completion record of a stage before running it, so that a stage stopped midway is run again."""
+
+        try:
+            os.remove(self._get_stage_record_path(stage))
+        except FileNotFoundError:
+            pass
+
+    def _save_stage_record(self, stage, fingerprint, output_paths):
+        """Saves the completion record of a stage of this species in stages/<species>/<stage>.json, once the stage is
+        done : its fingerprint and the content hashes of the files it made (the missing ones are left out).
+
+        PARAMS:
+            stage (str) -- the name of the stage.
+            fingerprint (dict) -- the fingerprint of the stage's inputs and parameters (see _get_fingerprint()).
+            output_paths (list) -- the paths of the files made by the stage.
+        """
+
+        record = {"fingerprint": fingerprint,
+                  "outputs": {os.path.relpath(path, self.main_directory): utils.get_file_hash(path)
+                              for path in output_paths if os.path.isfile(path)}}
+        record_path = self._get_stage_record_path(stage)
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        with open(record_path + ".tmp", "w") as record_file:
+            json.dump(record, record_file, indent=1, sort_keys=True)
+        os.replace(record_path + ".tmp", record_path)
+
     def _find_eggnog(self, target):
         return utils.find_file(self.main_directory + "/files/", target, ".tsv")
 
@@ -8,15 +8,21 @@
 Pathway Tools software reconstruction and launching of reconstruction 
 using mpwt package from AuReMe."""
 
+import annotation
 import argparse
+import copy
 import logging
 import module
 import mpwt
 import multiprocessing
-import numpy as np
-import re
+import os
+import shutil
+import sys
 import utils
 
+PATHOLOGIC_MEMORY = 4 * 1024 ** 3  # Memory (bytes) estimated for the PathoLogic run of one species
+PATHWAY_SCORE = 1  # Pathway score of the PathoLogic runs
+
 
 class Mpwting(module.Module):
 
@@ -26,7 +32,7 @@ class Mpwting(module.Module):
         self.genomic_fasta_file_path = self._find_genomic_fasta(self.name)
         self.gff_file_path = self._find_gff(self.name)
         self.eggnog_file_path = self._find_eggnog(self.name)
-        self.regions_dict = utils.get_sequence_region(self.gff_file_path)
+        self.genome_annotation = annotation.get_genome_annotation(self.gff_file_path)
 
     @property
     def directory(self):
@@ -36,77 +42,164 @@ class Mpwting(module.Module):
         circular = 'N'
         dat_file_str_list = []
         if self.element_type == "NONE":
-            for i in self.regions_dict.keys():
+            for i in self.genome_annotation.regions:
                 dat_file_str_list.append('ID\t%s\nCIRCULAR?\t%s\nANNOT-FILE\t%s\nSEQ-FILE\t%s\n//\n'
                                          % (i, circular, self.main_directory + i + '.pf',
                                             self.main_directory + i + '.fsa'))
         elif self.element_type == ":CONTIG":
-            for i in self.regions_dict.keys():
+            for i in self.genome_annotation.regions:
                 dat_file_str_list.append('ID\t%s\nchromosome_type\t%s\nANNOT-FILE\t%s\nSEQ-FILE\t%s\n//\n'
                                          % (i, self.element_type, self.main_directory + i + '.pf',
                                             self.main_directory + i + '.fsa'))
         else:
-            for i in self.regions_dict.keys():
+            for i in self.genome_annotation.regions:
                 dat_file_str_list.append(
                     'ID\t%s\nchromosome_type\t%s\nCIRCULAR?\t%s\nANNOT-FILE\t%s\nSEQ-FILE\t%s\n//\n' % (
                         i, self.element_type, circular, self.main_directory + i + '.pf',
                         self.main_directory + i + '.fsa'))
         utils.write_file(self.directory + "genetic-elements" + ".dat", dat_file_str_list)
 
-    def _make_fsa_files(self):
-        with open(self.genomic_fasta_file_path, "r") as file:
-            genomic_fasta = file.read()
-        genomic_fasta = genomic_fasta.split(">")
-        genomic_fasta = list(filter(None, genomic_fasta))
-        regions_list = list(self.regions_dict.keys())
-        for i in genomic_fasta:
-            region = re.search("\w+(\.\w+)*(\-\w+)*", i).group(0)
-            if region in regions_list:
-                regions_list.remove(region)
-                utils.write_file(self.directory + region + ".fsa", i, False)
-
-    def _make_pf_files(self):
-        tsv = utils.read_file_listed(self.eggnog_file_path)
-        list_index = list(np.arange(0, len(tsv)))
-        for region in self.regions_dict.keys():
-            sub_pf = []
-            for gene in self.regions_dict[region].keys():
-                for protein in self.regions_dict[region][gene]["Proteins"].keys():
-                    found = False
-                    for i in list_index:
-                        if found:
-                            break
-                        if protein in tsv[i]:
-                            list_index.remove(i)
-                            found = True
-                            sub_pf.append(self._eggnog_file_parser(region, gene, protein, tsv[i]))
-            if sub_pf:
-                f = open(self.directory + region + ".pf", "w")
-                for i in sub_pf:
-                    for j in i:
-                        f.write(j)
-                f.close()
-
-    def _eggnog_file_parser(self, region, gene, protein, line):
+    def _make_fsa_files(self, genomic_index=None):
+        """Function to copy each region's sequence from the genomic fasta into its .fsa file. Each file is written under
+        a temporary name and then renamed, so that an interrupted run never leaves a truncated .fsa file.
+
+        PARAMS:
+            genomic_index (dict) -- the index of the genomic fasta (default = read with utils.get_fasta_index()).
+        """
+
+        if genomic_index is None:
+            genomic_index = utils.get_fasta_index(self.genomic_fasta_file_path)
+        with open(self.genomic_fasta_file_path, "rb") as genomic_fasta:
+            for region in self.genome_annotation.regions:
+                try:
+                    offset, size = genomic_index[region]
+                except KeyError:
+                    logging.info("{} : Region {} not found in {}".format(self.name, region,
+                                                                         self.genomic_fasta_file_path))
+                    continue
+                fsa_path = self.directory + region + ".fsa"
+                with open(fsa_path + ".tmp", "wb") as fsa_file:
+                    utils.copy_file_part(genomic_fasta, fsa_file, offset, size)
+                os.replace(fsa_path + ".tmp", fsa_path)
+
+    def _get_eggnog_index(self):
+        """Function to read the eggNOG annotation file once, each line being split in its columns and indexed by the
+        query's ID (first column). Only the first line of a query is kept, as it is the best hit of eggNOG.
+
+        RETURNS:
+            eggnog_index (dict) -- {query ID (str): columns of the line (list)}.
+        """
+
+        eggnog_index = {}
+        with open(self.eggnog_file_path, "r") as eggnog_file:
+            for line in eggnog_file:
+                if line.startswith("#") or not line.strip():
+                    continue
+                spl = line.rstrip("\n").split("\t")
+                eggnog_index.setdefault(spl[0], spl)
+        return eggnog_index
+
+    def _get_eggnog_lines(self):
+        """Function to match each protein of the genome annotation with its eggNOG line, a line being given to the
+        first protein (in the gff's order) having its ID.
+
+        RETURNS:
+            eggnog_lines (dict) -- {protein's index (int): columns of its eggNOG line (list)}.
+        """
+
+        eggnog_index = self._get_eggnog_index()
+        eggnog_lines = {}
+        for protein_index, protein in enumerate(self.genome_annotation.proteins):
+            spl = eggnog_index.pop(protein, None)
+            if spl is not None:
+                eggnog_lines[protein_index] = spl
+        return eggnog_lines
+
+    def _make_pf_files(self, eggnog_lines=None):
+        """Function to write the .pf file of each region, streaming the entries of its annotated proteins. As for the
+        .fsa files, each file is written under a temporary name and then renamed.
+
+        PARAMS:
+            eggnog_lines (dict) -- the eggNOG line of the proteins (default = read with _get_eggnog_lines()).
+        """
+
+        genome_annotation = self.genome_annotation
+        if eggnog_lines is None:
+            eggnog_lines = self._get_eggnog_lines()
+        for region_index in range(len(genome_annotation.regions)):
+            pf_path = self.directory + genome_annotation.regions[region_index] + ".pf"
+            pf_file = None
+            for gene_index in genome_annotation.get_region_genes(region_index):
+                for protein_index in genome_annotation.get_gene_proteins(gene_index):
+                    if protein_index not in eggnog_lines:
+                        continue
+                    if pf_file is None:
+                        pf_file = open(pf_path + ".tmp", "w")
+                    pf_file.writelines(self._eggnog_file_parser(gene_index, protein_index, eggnog_lines[protein_index]))
+            if pf_file is not None:
+                pf_file.close()
+                os.replace(pf_path + ".tmp", pf_path)
+
+    def _get_region_tasks(self, nb_tasks):
+        """Function to split the making of the .fsa and .pf files into (at most) nb_tasks tasks of similar sizes, the
+        regions being given, from the largest to the smallest, to the least loaded task. Each task only carries the
+        annotation, the eggNOG lines and the genomic fasta's positions of its own regions : its organism is a copy of
+        this one holding the annotation of the task's regions only (see
+        annotation.GenomeAnnotation.get_regions_annotation()).
+
+        PARAMS:
+            nb_tasks (int) -- the maximum number of tasks.
+        RETURNS:
+            tasks (list) -- [(organism (Mpwting), eggnog_lines (dict), genomic_index (dict))], the eggNOG lines being
+            indexed by the proteins' indexes in the organism's annotation.
+        """
+
+        genome_annotation = self.genome_annotation
+        genomic_index = utils.get_fasta_index(self.genomic_fasta_file_path)
+        eggnog_lines = self._get_eggnog_lines()
+        nb_tasks = max(1, min(nb_tasks, len(genome_annotation.regions)))
+        chunks = [[] for _ in range(nb_tasks)]
+        loads = [0] * nb_tasks
+        sizes = [genomic_index.get(region, (0, 0))[1] for region in genome_annotation.regions]
+        for region_index in sorted(range(len(sizes)), key=lambda r: sizes[r], reverse=True):
+            i = loads.index(min(loads))
+            chunks[i].append(region_index)
+            loads[i] += sizes[region_index]
+        tasks = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            chunk.sort()
+            chunk_organism = copy.copy(self)
+            chunk_organism.genome_annotation = genome_annotation.get_regions_annotation(chunk)
+            protein_indexes = [protein_index for region_index in chunk
+                               for gene_index in genome_annotation.get_region_genes(region_index)
+                               for protein_index in genome_annotation.get_gene_proteins(gene_index)]
+            chunk_eggnog_lines = {i: eggnog_lines[protein_index] for i, protein_index in enumerate(protein_indexes)
+                                  if protein_index in eggnog_lines}
+            chunk_genomic_index = {genome_annotation.regions[r]: genomic_index[genome_annotation.regions[r]]
+                                   for r in chunk if genome_annotation.regions[r] in genomic_index}
+            tasks.append((chunk_organism, chunk_eggnog_lines, chunk_genomic_index))
+        return tasks
+
+    def _eggnog_file_parser(self, gene_index, protein_index, spl):
         """Sub-function of make_pf_files() to write the info in the correct order for each protein.
 
         PARAMS:
-            region (str) -- actual genomic scope.
-            gene (str) -- one gene id in the scope.
-            protein (str) -- one of the proteins coded by the gene above.
-            start (int) -- the start position of the sequence.
-            line (str) -- the line corresponding to the protein in the .tsv file.
+            gene_index (int) -- the index of one gene of the actual genomic scope in genome_annotation.
+            protein_index (int) -- the index of one of the proteins coded by the gene above.
+            spl (list) -- the columns of the line corresponding to the protein in the .tsv file.
         RETURNS:
             info (str) -- a string with all the information and with the correct
             file architecture settings for the .pf file.
         """
 
-        start = self.regions_dict[region][gene]["Start"]
-        end = self.regions_dict[region][gene]["End"]
-        cds_pos = self.regions_dict[region][gene]["Proteins"][protein]
+        gene = self.genome_annotation.genes[gene_index]
+        start = str(self.genome_annotation.gene_start[gene_index])
+        end = str(self.genome_annotation.gene_end[gene_index])
+        cds_pos = self.genome_annotation.get_protein_cds(protein_index)
 
         info = []
-        spl = line.split("\t")
         info.append("ID\t" + gene + "\n")
         if spl[8] == "-":
             info.append("NAME\tORF\n")
@@ -115,7 +208,6 @@ class Mpwting(module.Module):
         info.append("STARTBASE\t" + start + "\n")
         info.append("ENDBASE\t" + end + "\n")
         try:
-            spl[7] = spl[7].replace("\n", "")
             if spl[7]:
                 info.append("FUNCTION\t" + spl[7] + "\n")
         except IndexError:
@@ -135,6 +227,52 @@ class Mpwting(module.Module):
         info.append("//\n")
         return info
 
+    def _get_stage_fingerprint(self, stage):
+        """Returns the fingerprint of the inputs and parameters of a stage : mpwt_input or pathologic (see
+        module.Module._is_stage_done()). The PathoLogic run takes the mpwt input files recorded by the mpwt_input
+        stage as input."""
+
+        if stage == "mpwt_input":
+            return self._get_fingerprint({"gff": self.gff_file_path, "fna": self.genomic_fasta_file_path,
+                                          "eggnog": self.eggnog_file_path}, {"element_type": self.element_type})
+        input_record = self._get_stage_record("mpwt_input") or {"outputs": {}}
+        return {"inputs": input_record["outputs"], "parameters": {"pathway_score": PATHWAY_SCORE}}
+
+    def _get_input_files(self):
+        """Returns the paths of the mpwt input files made for this organism."""
+
+        return [self.directory + file for file in sorted(os.listdir(self.directory))
+                if file == "genetic-elements.dat" or file.endswith(".fsa") or file.endswith(".pf")]
+
+    def _get_pathologic_files(self):
+        """Returns the paths of the PathoLogic results of this organism used by the merging."""
+
+        return [self.main_directory + "mpwt/output/" + self.name + "/" + file
+                for file in ("reactions.dat", "proteins.dat", "enzrxns.dat")]
+
+    def _remove_pathologic_results(self):
+        """Removes the outdated PathoLogic results of this organism, mpwt wouldn't launch PathoLogic again if they were
+        kept."""
+
+        shutil.rmtree(self.main_directory + "mpwt/output/" + self.name, ignore_errors=True)
+        if self.name.lower() + "cyc" in mpwt.list_pgdb():
+            mpwt.remove_pgdbs([self.name.lower() + "cyc"], 1)
+
+    def _clean_directory(self):
+        """Removes the mpwt input files previously made for this organism, so that no file of a former region is
+        kept."""
+
+        for file in os.listdir(self.directory):
+            if file == "genetic-elements.dat" or file.endswith((".fsa", ".pf", ".tmp")):
+                os.remove(self.directory + file)
+
+    def _get_memory_estimate(self):
+        """Returns the estimated memory (bytes) needed by a process making the .fsa and .pf files of this organism : it
+        holds the genome annotation and the eggNOG lines, about three times the size of the gff and eggNOG files (the
+        genomic fasta being copied by blocks)."""
+
+        return 3 * (os.path.getsize(self.gff_file_path) + os.path.getsize(self.eggnog_file_path))
+
     def build(self):
         print(self.name + " : Creating the .dat files...")
         self._make_dat_files()
@@ -157,6 +295,46 @@ def make_taxon_file(directory, taxon_name_list):
     utils.write_csv(directory, "taxon_id", res, separator="\t")
 
 
+def make_run_directory(run_directory, list_objects):
+    """Function to make the folder given to mpwt to launch PathoLogic on the given organisms : a copy of their mpwt
+    input files and their lines of the taxon_id.tsv file. mpwt rewrites some of the input files (genetic-elements.dat,
+    organism-params.dat...), the ones recorded by the mpwt_input stage are kept as they were made.
+
+    PARAMS:
+        run_directory (str) -- the path to the folder, made again.
+        list_objects (list) -- the Mpwting objects.
+    """
+
+    input_directory = list_objects[0].main_directory + "mpwt/input/"
+    utils.remove_directory(run_directory)
+    utils.make_directory(run_directory)
+    for organism in list_objects:
+        shutil.copytree(organism.directory, run_directory + organism.name)
+    make_taxon_file(run_directory, [[organism.name] + read_taxon_line(input_directory, organism.name)
+                                    for organism in list_objects])
+
+
+def set_pathway_score(pathway_score):
+    """Function to set the pathway score of Pathway Tools (ptools-init.dat) once for all the PathoLogic runs launched
+    one species at a time (see run_pathologic()), mpwt changing it at the start and the end of each of its runs.
+
+    PARAMS:
+        pathway_score (float) -- score between 0 and 1 to accept or reject pathways.
+    RETURNS:
+        old_pathway_score (str) -- the former pathway score, to give to restore_pathway_score().
+    """
+
+    old_pathway_score = mpwt.utils.extract_pathway_score()
+    mpwt.utils.modify_pathway_score(pathway_score)
+    return old_pathway_score
+
+
+def restore_pathway_score(old_pathway_score):
+    """Function to restore the pathway score of Pathway Tools changed by set_pathway_score()."""
+
+    mpwt.utils.modify_pathway_score(old_pathway_score, comment_line=True)
+
+
 def mpwt_multirun_first(main_directory):
     """
     Split of major function 'run', first part = gathering the parameters, files and candidates' names and
@@ -190,34 +368,157 @@ def mpwt_multirun_first(main_directory):
         return [list_objects, cpu, input_directory, output_directory, log_directory]
 
 
-def mpwt_multirun_last(list_objects, cpu, input_directory, output_directory, log_directory):
+def mpwt_multirun_last(list_objects, cpu, input_directory, output_directory, log_directory, memory=None):
     """
     Split of major function 'run', second part = launching the process on each given object with multiprocessing
     and launching the mpwt reconstruction.
+    The input files are made again only for the organisms whose mpwt_input stage isn't up to date and only the
+    organisms whose pathologic stage isn't up to date go through PathoLogic (see module.Module._is_stage_done()), the
+    others keep their results.
+    The input files are made by as many processes as the cores and the memory allow (see utils.run_tasks()), as are
+    the PathoLogic runs (PATHOLOGIC_MEMORY each).
     """
 
-    p = multiprocessing.Pool(cpu)
-    p.map(build_mpwt_objects, list_objects)
     nb_cpu = multiprocessing.cpu_count()
-    if nb_cpu <= cpu:
-        cpu = nb_cpu - 1
+    changed_objects = []
+    tasks = []
+    for organism in list_objects:
+        input_fingerprint = organism._get_stage_fingerprint("mpwt_input")
+        if organism._is_stage_done("mpwt_input", input_fingerprint):
+            logging.info("{} : Input files unchanged, the mpwt input files are kept".format(organism.name))
+            print(organism.name + " : Input files unchanged, the mpwt input files are kept")
+            continue
+        organism._start_stage("mpwt_input")
+        changed_objects.append((organism, input_fingerprint))
+        organism._clean_directory()
+        print(organism.name + " : Creating the .dat files...")
+        organism._make_dat_files()
+        tasks.extend(organism._get_region_tasks(nb_cpu))
+    if tasks:
+        print("\n------\nCreating the .fsa and .pf files of %s species\n------" % len(changed_objects))
+        utils.run_tasks(build_mpwt_regions, tasks, [task[0]._get_memory_estimate() for task in tasks],
+                        [task[0].name + " : .fsa and .pf files of " + str(len(task[0].genome_annotation.regions)) +
+                         " region(s)" for task in tasks], memory=memory)
+    for organism, input_fingerprint in changed_objects:
+        organism._save_stage_record("mpwt_input", input_fingerprint, organism._get_input_files())
+    pathologic_objects = []
+    for organism in list_objects:
+        pathologic_fingerprint = organism._get_stage_fingerprint("pathologic")
+        if organism._is_stage_done("pathologic", pathologic_fingerprint):
+            logging.info("{} : Pathologic stage up to date, PathoLogic is not launched".format(organism.name))
+            continue
+        organism._start_stage("pathologic")
+        organism._remove_pathologic_results()
+        pathologic_objects.append((organism, pathologic_fingerprint))
+    if not pathologic_objects:
+        print("\n------\nAll the species are up to date, PathoLogic is not launched\n------")
+        return
+    if memory is None:
+        memory = utils.get_available_memory() or PATHOLOGIC_MEMORY * len(pathologic_objects)
+    cpu = max(1, min(cpu, len(pathologic_objects), nb_cpu - 1, memory // PATHOLOGIC_MEMORY))
+    run_directory = os.path.dirname(input_directory.rstrip("/")) + "/run_all/"
+    make_run_directory(run_directory, [organism for organism, pathologic_fingerprint in pathologic_objects])
     print("\n------\nNow launching MPWT on %s core(s)\n------" % cpu)
-    mpwt.multiprocess_pwt(input_folder=input_directory, output_folder=output_directory, patho_inference=True,
-                          patho_hole_filler=False, patho_operon_predictor=False, pathway_score=1, flat_creation=True,
-                          dat_extraction=True, number_cpu=cpu, size_reduction=False, patho_log=log_directory,
-                          taxon_file=input_directory + "taxon_id.tsv", verbose=True)
+    mpwt.multiprocess_pwt(input_folder=run_directory, output_folder=output_directory, patho_inference=True,
+                          patho_hole_filler=False, patho_operon_predictor=False, pathway_score=PATHWAY_SCORE,
+                          flat_creation=True, dat_extraction=True, number_cpu=cpu, size_reduction=False,
+                          patho_log=log_directory, taxon_file=run_directory + "taxon_id.tsv", verbose=True)
+    for organism, pathologic_fingerprint in pathologic_objects:
+        if os.path.isdir(output_directory + organism.name):
+            organism._save_stage_record("pathologic", pathologic_fingerprint, organism._get_pathologic_files())
+
 
+def build_mpwt_regions(task):
+    """Small function required for the multiprocessing reconstruction, making the .fsa and .pf files of a part of the
+    regions of one organism (see Mpwting._get_region_tasks())."""
 
-def build_mpwt_objects(organism):
-    """Small function required for the multiprocessing reconstruction."""
+    organism, eggnog_lines, genomic_index = task
+    organism._make_fsa_files(genomic_index)
+    organism._make_pf_files(eggnog_lines)
+
+
+def build_mpwt_input(organism, cpu=None, memory=None):
+    """Function to make the mpwt input files of one organism, if its mpwt_input stage isn't up to date (see
+    module.Module._is_stage_done()). Its .fsa and .pf files are made by 'cpu' processes within the memory budget (see
+    utils.run_tasks()).
+
+    PARAMS:
+        organism (Mpwting) -- the organism.
+        cpu (int) -- the number of processes making the .fsa and .pf files (default = number of cores).
+        memory (int) -- the memory budget in bytes (default = memory available).
+    """
+
+    input_fingerprint = organism._get_stage_fingerprint("mpwt_input")
+    if organism._is_stage_done("mpwt_input", input_fingerprint):
+        logging.info("{} : Input files unchanged, the mpwt input files are kept".format(organism.name))
+        print(organism.name + " : Input files unchanged, the mpwt input files are kept")
+        return
+    organism._start_stage("mpwt_input")
+    organism._clean_directory()
+    print(organism.name + " : Creating the .dat, .fsa and .pf files...")
+    organism._make_dat_files()
+    tasks = organism._get_region_tasks(cpu or multiprocessing.cpu_count())
+    utils.run_tasks(build_mpwt_regions, tasks, [organism._get_memory_estimate()] * len(tasks),
+                    [organism.name + " : .fsa and .pf files of " + str(len(task[0].genome_annotation.regions)) +
+                     " region(s)" for task in tasks], cpu, memory)
+    organism._save_stage_record("mpwt_input", input_fingerprint, organism._get_input_files())
+
+
+def run_pathologic(organism):
+    """Function to launch the mpwt reconstruction of one organism, if its pathologic stage isn't up to date (see
+    module.Module._is_stage_done()). mpwt runs every species of its input folder, so it is given a folder of its own
+    (mpwt/run/<organism>/, see make_run_directory()). The pathway score must have been set before (see
+    set_pathway_score()).
+
+    PARAMS:
+        organism (Mpwting) -- the organism.
+    """
+
+    mpwt_directory = organism.main_directory + "mpwt/"
+    output_directory = mpwt_directory + "output/"
+    pathologic_fingerprint = organism._get_stage_fingerprint("pathologic")
+    if organism._is_stage_done("pathologic", pathologic_fingerprint):
+        logging.info("{} : Pathologic stage up to date, PathoLogic is not launched".format(organism.name))
+        print(organism.name + " : Pathologic stage up to date, PathoLogic is not launched")
+        return
+    organism._start_stage("pathologic")
+    organism._remove_pathologic_results()
+    run_directory = mpwt_directory + "run/" + organism.name + "/"
+    log_directory = mpwt_directory + "log/" + organism.name + "/"
+    utils.make_directory(mpwt_directory + "run/")
+    make_run_directory(run_directory, [organism])
+    print(organism.name + " : Launching PathoLogic...")
+    mpwt.multiprocess_pwt(input_folder=run_directory, output_folder=output_directory, patho_inference=True,
+                          patho_hole_filler=False, patho_operon_predictor=False, flat_creation=True,
+                          dat_extraction=True, number_cpu=1, size_reduction=False, patho_log=log_directory,
+                          taxon_file=run_directory + "taxon_id.tsv", verbose=True)
+    if not os.path.isdir(output_directory + organism.name):
+        log_message = "{} : PathoLogic failed, see the logs in {}".format(organism.name, log_directory)
+        logging.error(log_message)
+        sys.exit(log_message)
+    organism._save_stage_record("pathologic", pathologic_fingerprint, organism._get_pathologic_files())
+
+
+def read_taxon_line(input_directory, name):
+    """Function to read the taxon id and the element type of one organism in the taxon_id.tsv file made by
+    make_taxon_file().
+
+    RETURNS:
+        [taxon id, element type] of the organism.
+    """
 
-    organism.build()
+    for row in utils.read_csv(input_directory + "taxon_id.tsv", "\t")[1:]:
+        if row[0] == name:
+            return row[1:]
+    log_message = "{} : Not found in {}".format(name, input_directory + "taxon_id.tsv")
+    logging.error(log_message)
+    sys.exit(log_message)
 
 
-def run(main_directory):
+def run(main_directory, memory=None):
     """The function to make all the run working."""
 
-    mpwt_multirun_last(*mpwt_multirun_first(main_directory))
+    mpwt_multirun_last(*mpwt_multirun_first(main_directory), memory=memory)
 
 
 def mpwt_arguments():
@@ -227,6 +528,8 @@ def mpwt_arguments():
     parser.add_argument("-v", "--verbose", help="Toggle the printing of more information", action="store_true")
     parser.add_argument("-le", "--log_erase", help="Erase the existing log file to create a brand new one",
                         action="store_true")
+    parser.add_argument("-mem", "--memory", help="The memory (Gb) that the processes running at the same time can "
+                                                 "use. Default=memory available", type=float)
     args = parser.parse_args()
     return args
 
@@ -242,7 +545,7 @@ def main():
     if args.verbose:
         logging.getLogger().addHandler(logging.StreamHandler())
     logging.info("------ Mpwting module started ------")
-    run(utils.slash(args.main_directory))
+    run(utils.slash(args.main_directory), int(args.memory * 1024 ** 3) if args.memory else None)
 
 
 if __name__ == "__main__":
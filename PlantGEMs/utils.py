@@ -7,13 +7,23 @@
 """This file contains utility functions used in several PlantGEMs' scripts."""
 
 import sys
+import cobra
 import configparser
+import copy
 import csv
+import hashlib
 import json
+import logging
+import mmap
+import multiprocessing
+import multiprocessing.connection
 import os
 import pickle
+import resource
 import subprocess
 import re
+import threading
+import time
 
 
 def build_correspondence_dict(path, sep="\t"):
@@ -121,6 +131,60 @@ def copy_file(start, end):
         print("File not found : " + start)
 
 
+def copy_file_part(source_file, destination_file, offset, size, block_size=1048576):
+    """Function to copy a part of a file into another one by blocks, so that the memory used doesn't depend on the size
+    of the copied part.
+
+    PARAMS:
+        source_file -- the file to copy from, opened in binary mode.
+        destination_file -- the file to copy to, opened in binary mode.
+        offset (int) -- the position of the part in the source file.
+        size (int) -- the size in bytes of the part.
+        block_size (int) -- the size in bytes of the blocks read (default = 1 Mb).
+    """
+
+    source_file.seek(offset)
+    while size > 0:
+        block = source_file.read(min(block_size, size))
+        if not block:
+            break
+        destination_file.write(block)
+        size -= len(block)
+
+
+def copy_reaction(reaction, metabolites, gene_reaction_rule=None):
+    """Function to copy a cobra reaction without its model (unlike copy.deepcopy(), which copies the whole model the
+    reaction belongs to). The copied metabolites are stored in the metabolites dictionary so that they are created only
+    once when copying several reactions for the same model.
+
+    PARAMS:
+        reaction -- the cobra reaction to copy.
+        metabolites (dict) -- the metabolites already copied {metabolite ID: cobra metabolite}, filled by the function.
+        gene_reaction_rule (str) -- the gene reaction rule of the copy (default : the one of the reaction).
+    RETURNS:
+        new_reaction -- the copied reaction, not linked to any model.
+    """
+
+    new_reaction = cobra.Reaction(reaction.id, reaction.name, reaction.subsystem, reaction.lower_bound,
+                                  reaction.upper_bound)
+    new_reaction.notes = copy.deepcopy(reaction.notes)
+    new_reaction.annotation = copy.deepcopy(reaction.annotation)
+    stoichiometry = {}
+    for metabolite, coefficient in reaction.metabolites.items():
+        if metabolite.id not in metabolites.keys():
+            new_metabolite = cobra.Metabolite(metabolite.id, metabolite.formula, metabolite.name, metabolite.charge,
+                                              metabolite.compartment)
+            new_metabolite.notes = copy.deepcopy(metabolite.notes)
+            new_metabolite.annotation = copy.deepcopy(metabolite.annotation)
+            metabolites[metabolite.id] = new_metabolite
+        stoichiometry[metabolites[metabolite.id]] = coefficient
+    new_reaction.add_metabolites(stoichiometry)
+    if gene_reaction_rule is None:
+        gene_reaction_rule = reaction.gene_reaction_rule
+    new_reaction.gene_reaction_rule = gene_reaction_rule
+    return new_reaction
+
+
 def find_file(directory, target, extension):  # TODO : take multiple file extensions in parameters
     """Search a file corresponding to the target in the 'files' directory. If no match is found,
     asks the user to input the exact path to the file he wants to use.
@@ -157,6 +221,97 @@ def find_files(directory, extension):
     return [i for i in os.listdir(slash(directory)) if i.endswith(dot(extension))]
 
 
+def get_available_memory():
+    """Returns the memory available on the computer in bytes (MemAvailable of /proc/meminfo, or the free memory if it
+    can't be read), None if it can't be known."""
+
+    try:
+        with open("/proc/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_fasta_index(path):
+    """Function to get the index of a fasta file, giving the position of each record in the file so that a sequence can
+    be read without loading the whole file. The index is stored next to the fasta file (.idx) and built again only if
+    the fasta file has changed (size or modification time) or if the index file is incomplete (its first line gives
+    the number of records, checked when reading it). It is written in a temporary file first, replacing the index file
+    only once complete.
+
+    PARAMS:
+        path (str) -- the path to the fasta file.
+    RETURNS:
+        index (dict) -- the position of each record : {sequence ID (str): (offset (int), size (int))}, with the offset
+        of the record's '>' and the size in bytes of the record (header included).
+    """
+
+    index_path = path + ".idx"
+    stat = os.stat(path)
+    signature = "#" + str(stat.st_size) + "\t" + str(stat.st_mtime_ns)
+    index = {}
+    if os.path.isfile(index_path):
+        with open(index_path, "r") as index_file:
+            header = index_file.readline().rstrip("\n").rsplit("\t", 1)
+            if header[0] == signature:
+                try:
+                    for line in index_file:
+                        spl = line.rstrip("\n").split("\t")
+                        index[spl[0]] = (int(spl[1]), int(spl[2]))
+                    if len(index) == int(header[1]):
+                        return index
+                except (IndexError, ValueError):
+                    pass
+                logging.warning("Incomplete fasta index, built again : " + index_path)
+                index = {}
+    if stat.st_size > 0:
+        with open(path, "rb") as fasta_file, \
+                mmap.mmap(fasta_file.fileno(), 0, access=mmap.ACCESS_READ) as fasta_map:
+            record_offset = 0 if fasta_map[:1] == b">" else fasta_map.find(b"\n>") + 1
+            while fasta_map[record_offset:record_offset + 1] == b">":
+                next_offset = fasta_map.find(b"\n>", record_offset) + 1
+                header_end = fasta_map.find(b"\n", record_offset)
+                header = fasta_map[record_offset + 1:header_end if header_end != -1 else len(fasta_map)].decode()
+                try:
+                    record_id = re.search('\w+(\.\w+)*(-\w+)*', header).group(0)
+                    index[record_id] = (record_offset, (next_offset or len(fasta_map)) - record_offset)
+                except AttributeError:
+                    print("Sequence ID not found in : " + header)
+                if not next_offset:
+                    break
+                record_offset = next_offset
+    try:
+        tmp_index_path = get_temporary_path(index_path)
+        write_file(tmp_index_path, [signature + "\t" + str(len(index))] +
+                   [k + "\t" + str(v[0]) + "\t" + str(v[1]) for k, v in index.items()])
+        os.replace(tmp_index_path, index_path)
+    except PermissionError:
+        print("Permission to write the fasta index :\n" + index_path + "\nnot granted !")
+    return index
+
+
+def get_file_hash(path):
+    """Function to compute the content hash of a file, read by blocks to avoid loading it entirely in memory.
+
+    PARAMS:
+        path (str) -- the path to the file.
+    RETURNS:
+        the hexadecimal md5 hash of the file's content.
+    """
+
+    file_hash = hashlib.md5()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1048576), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
 def get_list_directory(path):
     """Function to retrieve all the directories names at a specified location (path)
 
@@ -174,6 +329,39 @@ def get_list_directory(path):
     return list_directory
 
 
+def get_json_model_index(path):
+    """Function to index a cobra JSON model so that its reactions and metabolites can be read one by one, without
+    loading the whole model. Each reaction and metabolite is written on its own line in a records file stored next to
+    the model (.records), the index (.records.pkl) giving the position of each line. Both are built again only if the
+    JSON model has changed (size or modification time).
+
+    PARAMS:
+        path (str) -- the path to the JSON model.
+    RETURNS:
+        index (dict) -- {"reactions": {ID: (offset, size)}, "metabolites": {ID: (offset, size)}}, the positions of the
+        records in the records file (path + ".records").
+    """
+
+    records_path = path + ".records"
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    cache = load_obj(records_path + ".pkl")
+    if cache and cache["signature"] == signature and os.path.isfile(records_path):
+        return cache["index"]
+    data = read_json(path)
+    index = {"reactions": {}, "metabolites": {}}
+    tmp_records_path = get_temporary_path(records_path)
+    with open(tmp_records_path, "wb") as records_file:
+        for key in index.keys():
+            for record in data[key]:
+                line = (json.dumps(record) + "\n").encode()
+                index[key][record["id"]] = (records_file.tell(), len(line))
+                records_file.write(line)
+    os.replace(tmp_records_path, records_path)
+    save_obj({"signature": signature, "index": index}, records_path)
+    return index
+
+
 def get_metacyc_ids(metacyc_json_model_path):
     """Function to make the correspondence file between short and long ID of Metacyc."""
 
@@ -203,10 +391,21 @@ def get_metacyc_ids(metacyc_json_model_path):
     write_csv(os.path.dirname(metacyc_json_model_path), "/metacyc_ids", res, "\t")
 
 
+GFF_RNA_ID = re.compile('(?<=ID=)[RrNnAaTtSsCcIiPpMm]*[:-]*\w+(\.\w+)*(\-\w+)*')
+GFF_RNA_PREFIX = re.compile('([RrNnAaTtSsCcIiPpMm]*[:-])*')
+GFF_GENE_ID = re.compile('(?<=ID=)[GgEeNn]*[:-]*\w+(\.\w+)*(\-\w+)*')
+GFF_GENE_PREFIX = re.compile('([GgEeNn]*[:-])*')
+GFF_CDS_ID = re.compile('(?<=ID=)[CcDdSs]*[:-]*\w+(\.\w+)*')
+GFF_CDS_PREFIX = re.compile('([CcDdSs]*[:-])*')
+
+
 def get_sequence_region(gff_file_path):
     """Function that browses the .gff file and gets the name of each gene,
     the position in the genome and each corresponding region and protein(s).
+    The modules use the compact form of this dictionary (see annotation.get_genome_annotation()), which is cached.
 
+    PARAMS:
+        gff_file_path (str) -- the path to the gff file.
     RETURNS:
         regions_dict -- a dictionary containing all the gathered information (see pipelinePT() for the structure).
 
@@ -218,54 +417,59 @@ def get_sequence_region(gff_file_path):
     """
 
     regions_dict = {}
-    gff_file = read_file_listed(gff_file_path)
     protein_found = False  # Boolean to avoid testing a protein on each line that has already been found.
     cds_break = False  # Boolean to avoid an error if the CDS's name hasn't been found.
     region = None  # Assignment before use
     gene = None  # Assignment before use
     protein = None  # Assignment before use
     rna = None  # Assignment before use
-    for line in gff_file:
-        if "RNA\t" in line:
-            protein_found = False
-            cds_break = False
-            try:
-                rna = re.search('(?<=ID=)[RrNnAaTtSsCcIiPpMm]*[:-]*\w+(\.\w+)*(\-\w+)*', line).group(0)
-                garbage = re.search('([RrNnAaTtSsCcIiPpMm]*[:-])*', rna).group(0)
-                rna = str.replace(rna, garbage, "")
-            except AttributeError:
-                print("RNA ID not found, might cause a problem if CDS name is different than RNA.\n", line)
-                pass
-        if "\tgene\t" in line:  # Searching the gene's information
-            protein_found = False
-            spl = line.split("\t")
-            region = spl[0]
-            try:
-                gene = re.search('(?<=ID=)[GgEeNn]*[:-]*\w+(\.\w+)*(\-\w+)*', line).group(0)
-                garbage = re.search('([GgEeNn]*[:-])*', gene).group(0)
-                gene = str.replace(gene, garbage, "")
-            except AttributeError:
-                print("The gene name hasn't been found here : {}", format(line))
-                break
-            if region not in regions_dict.keys():
-                regions_dict[region] = {}
-            regions_dict[region][gene] = {"Start": spl[3], "End": spl[4], "Proteins": {}}
-        if region and gene and not protein_found and "\tCDS\t" in line:  # Searching the protein's information
-            try:
-                protein = re.search('(?<=ID=)[CcDdSs]*[:-]*\w+(\.\w+)*', line).group(0)
-                garbage = re.search('([CcDdSs]*[:-])*', protein).group(0)
-                protein = str.replace(protein, garbage, "")
-                if protein[:-2] == rna:  # I check if the GFF is compatible with the faa file for the tsv annotation
-                    protein, rna = rna, protein
-                regions_dict[region][gene]["Proteins"][protein] = []
-                protein_found = True
+    with open(gff_file_path, "r") as gff_file:
+        for line in gff_file:
+            if line.startswith("#"):
+                if line.startswith("##FASTA"):
+                    break
+                continue
+            spl = line.split("\t", 8)
+            if len(spl) < 9:
+                continue
+            feature = spl[2]
+            if feature.endswith("RNA"):
+                protein_found = False
                 cds_break = False
-            except AttributeError:
-                print("The CDS has no attribute 'ID='...")
-                cds_break = True
-        if not cds_break and "\tCDS\t" in line:  # Searching the CDS' information
-            spl = line.split("\t")
-            regions_dict[region][gene]["Proteins"][protein].append([int(spl[3]), int(spl[4])])
+                try:
+                    rna = GFF_RNA_ID.search(spl[8]).group(0)
+                    rna = str.replace(rna, GFF_RNA_PREFIX.search(rna).group(0), "")
+                except AttributeError:
+                    print("RNA ID not found, might cause a problem if CDS name is different than RNA.\n", line)
+                    pass
+            elif feature == "gene":  # Searching the gene's information
+                protein_found = False
+                region = spl[0]
+                try:
+                    gene = GFF_GENE_ID.search(spl[8]).group(0)
+                    gene = str.replace(gene, GFF_GENE_PREFIX.search(gene).group(0), "")
+                except AttributeError:
+                    print("The gene name hasn't been found here : {}".format(line))
+                    break
+                if region not in regions_dict.keys():
+                    regions_dict[region] = {}
+                regions_dict[region][gene] = {"Start": spl[3], "End": spl[4], "Proteins": {}}
+            elif feature == "CDS":
+                if region and gene and not protein_found:  # Searching the protein's information
+                    try:
+                        protein = GFF_CDS_ID.search(spl[8]).group(0)
+                        protein = str.replace(protein, GFF_CDS_PREFIX.search(protein).group(0), "")
+                        # I check if the GFF is compatible with the faa file for the tsv annotation
+                        if protein[:-2] == rna:
+                            protein, rna = rna, protein
+                        regions_dict[region][gene]["Proteins"][protein] = []
+                        protein_found = True
+                        cds_break = False
+                    except AttributeError:
+                        print("The CDS has no attribute 'ID='...")
+                        cds_break = True
+                if not cds_break:  # Searching the CDS' information
+                    regions_dict[region][gene]["Proteins"][protein].append([int(spl[3]), int(spl[4])])
     return regions_dict
 
 
@@ -300,11 +504,16 @@ def get_list_reactions_cobra(model):
 
 
 def load_obj(path):
-    """Loads a pickle object."""
+    """Loads a pickle object. Returns None if the file doesn't exist or can't be read (e.g. truncated by a crash during
+    its writing), so that a cache in this state is made again."""
 
     if check_path(path):
-        with open(path, 'rb') as input_file:
-            return pickle.load(input_file)
+        try:
+            with open(path, 'rb') as input_file:
+                return pickle.load(input_file)
+        except (EOFError, pickle.UnpicklingError) as error:
+            logging.warning("Unreadable pickle file, ignored : {} ({})".format(path, repr(error)))
+            return None
 
 
 def make_directory(directory):
@@ -324,22 +533,56 @@ def make_directory(directory):
         print("Directory already exists : ", directory)
 
 
+def measure_task(function, task, connection):
+    """Sub-function of run_tasks() calling the function on the task in a worker process and sending back its result
+    through the connection. The worker is forked from the parent process, whose memory is counted in its RSS : only the
+    increase of its peak memory during the task is given.
+
+    PARAMS:
+        function -- the function applied to the task.
+        task -- the argument of the function.
+        connection (multiprocessing.connection.Connection) -- the connection to the parent process, which gets the
+        result of the function, the peak memory (RSS) of the worker process during the task minus its RSS at the start
+        of the task in bytes, and the error raised by the function (None if it succeeded).
+    """
+
+    start_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        result = function(task)
+    except Exception as error:
+        connection.send((None, None, error))
+        return
+    connection.send((result, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_memory) * 1024, None))
+
+
 def migrate(main_directory):
+    list_species = get_list_directory(main_directory + "blast/")
+    for species in list_species:
+        migrate_species(main_directory, species)
+
+
+def migrate_species(main_directory, species):
+    """Function to copy the blast draft and the Pathway Tools' .dat files of one species in its merge directory, ready
+    to be merged.
+
+    PARAMS:
+        main_directory (str) -- the main directory of the run.
+        species (str) -- the name of the species.
+    """
+
     blast_directory = main_directory + "blast/"
     merge_directory = main_directory + "merge/"
     mpwt_directory = main_directory + "mpwt/"
     make_directory(merge_directory)
-    list_species = get_list_directory(blast_directory)
-    for species in list_species:
-        make_directory(merge_directory + species)
-        copy_file(blast_directory + species + "/" + species + "_blast_draft.json",
-                  merge_directory + species + "/" + species + "_blast_draft.json")
-        copy_file(mpwt_directory + "/output/" + species + "/reactions.dat",
-                  merge_directory + species + "/reactions.dat")
-        copy_file(mpwt_directory + "/output/" + species + "/proteins.dat",
-                  merge_directory + species + "/proteins.dat")
-        copy_file(mpwt_directory + "/output/" + species + "/enzrxns.dat",
-                  merge_directory + species + "/enzrxns.dat")
+    make_directory(merge_directory + species)
+    copy_file(blast_directory + species + "/" + species + "_blast_draft.json",
+              merge_directory + species + "/" + species + "_blast_draft.json")
+    copy_file(mpwt_directory + "/output/" + species + "/reactions.dat",
+              merge_directory + species + "/reactions.dat")
+    copy_file(mpwt_directory + "/output/" + species + "/proteins.dat",
+              merge_directory + species + "/proteins.dat")
+    copy_file(mpwt_directory + "/output/" + species + "/enzrxns.dat",
+              merge_directory + species + "/enzrxns.dat")
 
 
 def dot(extension):
@@ -380,6 +623,24 @@ def read_csv(path, delim):
     return res
 
 
+def read_fasta_record(fasta_file, index, record_id):
+    """Function to read a single record of a fasta file thanks to its index (see get_fasta_index()).
+
+    PARAMS:
+        fasta_file -- the fasta file, opened in binary mode.
+        index (dict) -- the index of the fasta file.
+        record_id (str) -- the ID of the record to read.
+    RETURNS:
+        header (str) -- the header line of the record, without the '>'.
+        sequence (str) -- the sequence of the record, without line breaks.
+    """
+
+    offset, size = index[record_id]
+    fasta_file.seek(offset)
+    record = fasta_file.read(size).decode().split("\n", 1)
+    return record[0][1:].rstrip("\r"), "".join(record[1].split()) if len(record) > 1 else ""
+
+
 def read_file_listed(path):
     """Function to read and return a file line by line in a list."""
 
@@ -417,11 +678,146 @@ def remove_directory(directory):
         print("Permission to erase this folder :\n" + directory + "\nnot granted !")
 
 
+def run_task_graph(nodes, cpu=None, memory=None):
+    """Function to run a graph of tasks : each task runs in its own process as soon as the tasks it depends on are done
+    and the cores and the memory of the running tasks leave room for its own (a task larger than the budget is run
+    alone). The tasks are launched in the order of the nodes when several are ready. A task that fails doesn't stop the
+    others, only the tasks depending on it are not launched.
+
+    PARAMS:
+        nodes (dict) -- {name: (function, args, dependencies, cores, memory estimate)}, the function is called with the
+        args (tuple), the dependencies are the names of the tasks that must be done before and the memory estimate in
+        bytes can be a function, called once the dependencies are done (when the files it measures exist).
+        cpu (int) -- the number of cores shared by the tasks running at the same time (default = number of cores).
+        memory (int) -- the memory budget in bytes (default = memory available at the call).
+    RETURNS:
+        failed (list) -- the names of the tasks that failed or were not launched because a task they depend on failed.
+    """
+
+    cpu = cpu or multiprocessing.cpu_count()
+    if memory is None:
+        memory = get_available_memory() or float("inf")
+    waiting = list(nodes.keys())
+    running = {}
+    done = set()
+    failed = []
+    memory_estimates = {}
+    while waiting or running:
+        for name in list(waiting):
+            function, args, dependencies, cores, memory_estimate = nodes[name]
+            if any(dependency in failed for dependency in dependencies):
+                logging.error("{} : Not launched, a task it depends on failed".format(name))
+                waiting.remove(name)
+                failed.append(name)
+                continue
+            if not all(dependency in done for dependency in dependencies):
+                continue
+            if name not in memory_estimates:
+                memory_estimates[name] = memory_estimate() if callable(memory_estimate) else memory_estimate
+            if running and (sum(task[1] for task in running.values()) + cores > cpu or
+                            sum(task[2] for task in running.values()) + memory_estimates[name] > memory):
+                continue
+            logging.info("{} : Launched on {} core(s) (estimated memory {:.0f} Mb)".format(
+                name, cores, memory_estimates[name] / 1048576))
+            process = multiprocessing.Process(target=function, args=args, name=name)
+            process.start()
+            waiting.remove(name)
+            running[process.sentinel] = (name, cores, memory_estimates[name], process, time.time())
+        if not running:
+            if waiting:
+                raise ValueError("Unknown or circular dependencies for : " + ", ".join(waiting))
+            break
+        for sentinel in multiprocessing.connection.wait(list(running.keys())):
+            name, cores, memory_estimate, process, start_time = running.pop(sentinel)
+            process.join()
+            if process.exitcode == 0:
+                logging.info("{} : Done in {:.0f} s".format(name, time.time() - start_time))
+                done.add(name)
+            else:
+                logging.error("{} : Failed (exit code {})".format(name, process.exitcode))
+                failed.append(name)
+    return failed
+
+
+def run_tasks(function, tasks, memory_estimates, names, cpu=None, memory=None):
+    """Function to run tasks on processes limited by both the number of cores and a memory budget. A task is launched
+    only when the memory estimates of the running tasks leave room for its own (a task larger than the budget is run
+    alone), the others wait in the queue. Each task runs in a new process so that the memory (RSS) it adds to the
+    process can be measured : it is logged next to the estimate, to adjust the estimates. A task whose process dies
+    (killed by the system when out of memory...) fails, its memory is given back to the others.
+
+    PARAMS:
+        function -- the function applied to each task (defined at a module's level, to be sent to the workers).
+        tasks (list) -- the argument of each call to the function.
+        memory_estimates (list) -- the memory needed by each task in bytes.
+        names (list) -- the name of each task, for the logs.
+        cpu (int) -- the maximum number of tasks running at the same time (default = number of cores).
+        memory (int) -- the memory budget in bytes (default = memory available at the call).
+    RETURNS:
+        results (list) -- the result of the function for each task, in the tasks' order.
+    RAISES:
+        the error of the first task that failed, once the other tasks are done.
+    """
+
+    if not tasks:
+        return []
+    cpu = min(cpu or multiprocessing.cpu_count(), len(tasks))
+    if memory is None:
+        memory = get_available_memory() or sum(memory_estimates)
+    queue = list(range(len(tasks)))
+    running = {}
+    results = [None] * len(tasks)
+    errors = []
+    while queue or running:
+        for i in list(queue):
+            if len(running) >= cpu:
+                break
+            if running and sum(memory_estimates[j] for j, process in running.values()) + memory_estimates[i] > memory:
+                continue
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=measure_task, args=(function, tasks[i], sender), name=names[i])
+            process.start()
+            # Only the worker holds the sending end, so that its death ends the connection
+            sender.close()
+            queue.remove(i)
+            running[receiver] = (i, process)
+        for receiver in multiprocessing.connection.wait(list(running.keys())):
+            i, process = running.pop(receiver)
+            try:
+                result, task_memory, error = receiver.recv()
+            except EOFError:
+                process.join()
+                result, task_memory = None, None
+                error = RuntimeError("Process ended without result (exit code {})".format(process.exitcode))
+            receiver.close()
+            process.join()
+            if error is not None:
+                logging.error("{} : {}".format(names[i], repr(error)))
+                errors.append(error)
+                continue
+            results[i] = result
+            logging.info("{} : memory used {:.0f} Mb (estimated {:.0f} Mb)".format(names[i], task_memory / 1048576,
+                                                                                 memory_estimates[i] / 1048576))
+    if errors:
+        raise errors[0]
+    return results
+
+
+def get_temporary_path(path):
+    """Function to get the path of the temporary file written before replacing the file at 'path'. It is unique to the
+    process and the thread, since several of them may write the same file (cache, index...) at the same time."""
+
+    return "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+
+
 def save_obj(obj, path):
-    """Saves an object in a pickle file."""
+    """Saves an object in a pickle file. The object is written in a temporary file first, replacing the pickle file
+    only once complete, so that a crash never leaves a truncated pickle file."""
 
-    with open(path + '.pkl', 'wb+') as output:
+    tmp_path = get_temporary_path(path + '.pkl')
+    with open(tmp_path, 'wb+') as output:
         pickle.dump(obj, output, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path + '.pkl')
 
 
 def slash(directory):